@@ -4,8 +4,9 @@ Created on Apr 18, 2014
 @author: jeromethai
 '''
 
-from cvxopt import matrix
+from cvxopt import matrix, spmatrix
 import numpy as np
+import scipy.sparse as sps
 import logging
 
 class Graph:
@@ -24,11 +25,14 @@ class Graph:
         self.indlinks = {} # indexation for matrix generations
         self.indods = {} # indexation for matrix generations
         self.indpaths = {} # indexation for matrix generations
+        self.pathkeys = {} # path id of each tuple of link ids, to detect duplicate paths
+        self.arrays = None # array-backed representation, see get_arrays()
         
     
     def add_node(self, position=None):
         """Add a node with coordinates as a tuple"""
         self.numnodes += 1
+        self.arrays = None
         self.nodes_position[self.numnodes] = position
         self.nodes[self.numnodes] = Node(position)
         
@@ -50,6 +54,7 @@ class Graph:
             logging.error('link ({},{},{}) already exists.'.format(startnode, endnode, route)); return
         else:
             link = Link(startnode, endnode, route, float(flow), float(delay), float(ffdelay), delayfunc)
+            self.arrays = None
             self.indlinks[(startnode, endnode, route)] = self.numlinks
             self.numlinks += 1
             self.links[(startnode, endnode, route)] = link
@@ -79,6 +84,7 @@ class Graph:
         if (origin, destination) in self.ODs:
             logging.error('OD ({},{}) already exists'.format(origin, destination)); return
         else:
+            self.arrays = None
             self.indods[(origin, destination)] = self.numODs
             self.numODs += 1
             od = OD(origin, destination, float(flow))
@@ -103,19 +109,21 @@ class Graph:
         for i in range(len(link_ids)-1):
             if link_ids[i][1] != link_ids[i+1][0]: logging.error('path not valid.'); return
         
-        for path in self.ODs[(origin, destination)].paths.values():
-            if [(link.startnode,link.endnode,link.route) for link in path.links] == link_ids: logging.error('path already exists.'); return
+        key = tuple([tuple(id) for id in link_ids])
+        if key in self.pathkeys: logging.error('path already exists.'); return
         
         links = []; delay = 0.0; ffdelay = 0.0
         for id in link_ids:
             link = self.links[(id[0], id[1], id[2])]; links.append(link); delay += link.delay; ffdelay += link.ffdelay
             
+        self.arrays = None
         self.ODs[(origin, destination)].numpaths += 1
         route = self.ODs[(origin, destination)].numpaths
         path = Path(origin, destination, route, links, 0.0, delay, ffdelay)
         self.indpaths[(origin, destination, route)] = self.numpaths
         self.numpaths += 1
         self.paths[(origin, destination, route)] = path
+        self.pathkeys[key] = (origin, destination, route)
         self.ODs[(origin, destination)].paths[(origin, destination, route)] = path
         for link in links:
             self.links[(link.startnode, link.endnode, link.route)].numpaths += 1
@@ -186,6 +194,13 @@ class Graph:
 
         
         
+    def get_arrays(self):
+        """Get the array-backed representation of the graph
+        it is built on the first call and rebuilt after nodes, links, ODs or paths are added"""
+        if self.arrays is None: self.arrays = GraphArrays(self)
+        return self.arrays
+        
+        
     def get_linkflows(self):
         """Get link flows in a column cvxopt matrix"""
         linkflows = matrix(0.0, (self.numlinks, 1))
@@ -195,16 +210,12 @@ class Graph:
     
     def get_ffdelays(self):
         """Get ffdelays in a column cvxopt matrix"""
-        ffdelays = matrix(0.0, (self.numlinks, 1))
-        for id,link in self.links.items(): ffdelays[self.indlinks[id]] = link.delayfunc.ffdelay
-        return ffdelays
+        return matrix(self.get_arrays().ffdelays)
     
     
     def get_slopes(self):
         """Get slopes in a column cvxopt matrix"""
-        slopes = matrix(0.0, (self.numlinks, 1))
-        for id,link in self.links.items(): slopes[self.indlinks[id]] = link.delayfunc.slope
-        return slopes
+        return matrix(self.get_arrays().slopes)
     
     
     def get_coefs(self):
@@ -214,13 +225,9 @@ class Graph:
         ------------
         coefs[i,j] = coef[j] for link i
         """
-        type = self.links.values()[0].delayfunc.type
-        if type != 'Polynomial': logging.error('Delay functions must be polynomial'); return
-        n, degree = self.numlinks, self.links.values()[0].delayfunc.degree
-        coefs = matrix(0.0, (n, degree))
-        for id,link in self.links.items():
-            for j in range(degree): coefs[self.indlinks[id],j] = link.delayfunc.coef[j]
-        return coefs
+        arrays = self.get_arrays()
+        if arrays.delaytype != 'Polynomial': logging.error('Delay functions must be polynomial'); return
+        return matrix(arrays.coefs)
     
     
     def get_ks(self):
@@ -230,13 +237,9 @@ class Graph:
         ------------
         k[i,j] = kj for link i with j=1,2
         """
-        type = self.links.values()[0].delayfunc.type
-        if type != 'Hyperbolic': logging.error('Delay functions must be hyperbolic'); return
-        ks = matrix(0.0, (self.numlinks,2))
-        for id,link in self.links.items():
-            i = self.indlinks[id]
-            ks[i,0], ks[i,1] = link.delayfunc.k1, link.delayfunc.k2
-        return ks
+        arrays = self.get_arrays()
+        if arrays.delaytype != 'Hyperbolic': logging.error('Delay functions must be hyperbolic'); return
+        return matrix(arrays.ks)
         
         
     def get_parameters(self):
@@ -246,16 +249,26 @@ class Graph:
         if type == 'Hyperbolic': return self.get_ks(), type
         
     
+    def get_delay_model(self):
+        """Get the DelayModel evaluating the delays of all the links at once"""
+        return self.get_arrays().model
+        
+        
     def update_linkflows_linkdelays(self, linkflows):
         """Update link flows and link delays in Graph object"""
-        for id,link in self.links.items():
-            flow = linkflows[self.indlinks[id]]
-            link.flow, link.delay = flow, link.delayfunc.compute_delay(flow)
+        arrays = self.get_arrays()
+        flows = np.asarray(linkflows, dtype=float).ravel()
+        delays = arrays.model.delays(flows)
+        for i,id in enumerate(arrays.link_ids):
+            self.links[id].flow, self.links[id].delay = flows[i], delays[i]
         
         
     def update_pathdelays(self):
-        """Update path delays in Graph object"""
-        for path in self.paths.values(): path.delay = sum([link.delay for link in path.links])
+        """Update path delays in Graph object with the path-link incidence of get_arrays()"""
+        arrays = self.get_arrays()
+        linkdelays = np.array([self.links[id].delay for id in arrays.link_ids], dtype=float)
+        delays = arrays.path_incidence.dot(linkdelays)
+        for k,id in enumerate(arrays.path_ids): self.paths[id].delay = delays[k]
         
         
     def update_pathflows(self, pathflows):
@@ -273,6 +286,100 @@ class Graph:
                 intlk_ids.append(id)                
         return intlk_ids
 
+class GraphArrays:
+    """Frozen array-backed representation of a Graph object
+    
+    Links, nodes, ODs and paths are indexed as in graph.indlinks, node id-1,
+    graph.indods and graph.indpaths. All arrays are read-only snapshots of the graph
+    at construction, use graph.get_arrays() to get an up-to-date representation
+    
+    Attributes
+    ----------
+    link_ids: link_ids[i] = (startnode, endnode, route) of link i
+    startnodes, endnodes: 0-based indices of the start/end node of each link
+    out_ptr, out_links: CSR adjacency, the links leaving node u are out_links[out_ptr[u]:out_ptr[u+1]]
+    in_ptr, in_links: CSR adjacency, the links entering node u are in_links[in_ptr[u]:in_ptr[u+1]]
+    ffdelays, slopes: free flow delays and slopes of the links
+    delaytype: type of the delay functions if all links share the same type, else None
+    coefs: coefs[i,j] = coef[j] for link i if delaytype is 'Polynomial', else None
+    ks: ks[i,:] = (k1,k2) for link i if delaytype is 'Hyperbolic', else None
+    model: DelayModel of the links, also for mixed delay types
+    od_ids, origins, destinations, demands: OD pairs with 0-based origin/destination indices
+    path_ids: path_ids[k] = (origin, destination, route) of path k
+    path_ods: index of the OD pair of each path
+    path_ptr, path_links: CSR path-link incidence, the links of path k are path_links[path_ptr[k]:path_ptr[k+1]]
+    path_incidence: the path-link incidence as a scipy.sparse.csr_matrix of size (numpaths, numlinks)
+    path_od_incidence: the path-OD incidence as a scipy.sparse.csr_matrix of size (numpaths, numODs)
+    the two scipy matrices share the buffers path_ptr, path_links and path_ods, their transposes are CSC views
+    linkpath, odpath: the link-path and OD-path incidences as cvxopt spmatrix, i.e. the transposes
+    of path_incidence and path_od_incidence, cvxopt copies the indices once per GraphArrays
+    """
+    def __init__(self, graph):
+        m, n = graph.numnodes, graph.numlinks
+        self.numnodes, self.numlinks, self.numODs, self.numpaths = m, n, graph.numODs, graph.numpaths
+        
+        self.link_ids = [None]*n
+        for id,i in graph.indlinks.items(): self.link_ids[i] = id
+        links = [graph.links[id] for id in self.link_ids]
+        self.startnodes = np.array([link.startnode-1 for link in links], dtype=int)
+        self.endnodes = np.array([link.endnode-1 for link in links], dtype=int)
+        self.out_ptr, self.out_links = csr_index(self.startnodes, m)
+        self.in_ptr, self.in_links = csr_index(self.endnodes, m)
+        
+        funcs = [link.delayfunc for link in links]
+        types = [None if f is None else f.type for f in funcs]
+        self.ffdelays = np.array([link.ffdelay for link in links], dtype=float)
+        self.slopes = np.array([np.nan if f is None else f.slope for f in funcs], dtype=float)
+        self.delaytype = types[0] if len(set(types)) == 1 else None
+        coefs = np.zeros((n, max([f.degree for f,t in zip(funcs, types) if t == 'Polynomial'] + [0])))
+        ks = np.zeros((n,2))
+        for i,f in enumerate(funcs):
+            if types[i] == 'Polynomial': coefs[i,:f.degree] = f.coef
+            if types[i] == 'Hyperbolic': ks[i,:] = (f.k1, f.k2)
+        self.coefs = coefs if self.delaytype == 'Polynomial' else None
+        self.ks = ks if self.delaytype == 'Hyperbolic' else None
+        self.model = DelayModel(self.ffdelays, types, coefs, ks)
+        
+        self.od_ids = [None]*graph.numODs
+        for id,k in graph.indods.items(): self.od_ids[k] = id
+        self.origins = np.array([o-1 for o,d in self.od_ids], dtype=int)
+        self.destinations = np.array([d-1 for o,d in self.od_ids], dtype=int)
+        self.demands = np.array([graph.ODs[id].flow for id in self.od_ids], dtype=float)
+        
+        self.path_ids = [None]*graph.numpaths
+        for id,k in graph.indpaths.items(): self.path_ids[k] = id
+        paths = [graph.paths[id] for id in self.path_ids]
+        # int32 is the index type of scipy.sparse, the scipy matrices below share these arrays
+        self.path_ods = np.array([graph.indods[(path.o, path.d)] for path in paths], dtype=np.int32)
+        self.path_ptr = np.zeros(len(paths)+1, dtype=np.int32)
+        self.path_ptr[1:] = np.cumsum([len(path.links) for path in paths])
+        self.path_links = np.array([graph.indlinks[(link.startnode, link.endnode, link.route)]
+                                    for path in paths for link in path.links], dtype=np.int32)
+        self.path_incidence = sps.csr_matrix((np.ones(len(self.path_links)), self.path_links, self.path_ptr),
+                                             shape=(len(paths), n), copy=False)
+        self.path_od_incidence = sps.csr_matrix((np.ones(len(paths)), self.path_ods, np.arange(len(paths)+1)),
+                                                shape=(len(paths), graph.numODs), copy=False)
+        path_cols = np.repeat(np.arange(len(paths)), np.diff(self.path_ptr))
+        self.linkpath = spmatrix(1.0, self.path_links, path_cols, (n, len(paths)))
+        self.odpath = spmatrix(1.0, self.path_ods, range(len(paths)), (graph.numODs, len(paths)))
+        
+        for value in self.__dict__.values():
+            if isinstance(value, np.ndarray): value.flags.writeable = False
+
+
+def csr_index(rows, m):
+    """Return ptr, ind such that ind[ptr[u]:ptr[u+1]] are the positions k with rows[k] == u
+    
+    Parameters
+    ----------
+    rows: numpy array of row indices in range(m)
+    m: number of rows
+    """
+    ptr = np.zeros(m+1, dtype=int)
+    ptr[1:] = np.cumsum(np.bincount(rows, minlength=m))
+    return ptr, np.argsort(rows, kind='mergesort')
+
+
 class Link:
     """A link in the graph"""
     def __init__(self, startnode, endnode, route, flow=0.0, delay=0.0, ffdelay=0.0, delayfunc=None):
@@ -356,6 +463,80 @@ class HyperDelay:
         return ffdelay - k1/k2 + k1/(k2-flow)
         
 
+class DelayModel:
+    """Delay functions of all the links of a network, evaluated at once on a vector of link flows,
+    the links can have different types of delay functions
+    
+    delay_i(x) = ffdelay_i + sum_{k>=1} coefs[i,k-1]*x^k for a polynomial link
+    delay_i(x) = ffdelay_i - k1_i/k2_i + k1_i/(k2_i-x) for a hyperbolic link
+    delay_i(x) = ffdelay_i for a link without delay function
+    
+    Parameters
+    ----------
+    ffdelays: free flow delays of the n links
+    types: type of the delay function of each link ('Polynomial', 'Hyperbolic' or None),
+    or one type for all the links
+    coefs: coefs[i,:] = coef of the polynomial links, the other rows are ignored
+    ks: ks[i,:] = (k1,k2) of the hyperbolic links, the other rows are ignored
+    """
+    def __init__(self, ffdelays, types, coefs=None, ks=None):
+        self.ffdelays = np.asarray(ffdelays, dtype=float).ravel()
+        n = len(self.ffdelays)
+        if types is None or isinstance(types, str): types = [types]*n
+        types = np.array(types, dtype=object)
+        self.poly = np.flatnonzero(types == 'Polynomial')
+        self.hyper = np.flatnonzero(types == 'Hyperbolic')
+        if coefs is None: coefs = np.zeros((n,0))
+        if ks is None: ks = np.zeros((n,2))
+        self.coefs = np.asarray(coefs, dtype=float).reshape((n,-1))[self.poly]
+        self.ks = np.asarray(ks, dtype=float).reshape((n,2))[self.hyper]
+        
+    def evaluate(self, flows):
+        """Evaluate the delay functions at the link flows
+        
+        Parameters
+        ----------
+        flows: link flows, numpy array or cvxopt matrix of size n
+        
+        Return value
+        ------------
+        integrals: integrals of the delays from 0 to flows[i] (terms of the Beckmann potential)
+        delays: delays at flows[i]
+        derivatives: derivatives of the delays at flows[i]
+        """
+        x = np.asarray(flows, dtype=float).ravel()
+        integrals, delays, derivatives = self.ffdelays*x, self.ffdelays.copy(), np.zeros(len(x))
+        if len(self.poly) > 0:
+            u, c = x[self.poly], self.coefs
+            # Horner's scheme on q(u) = sum_k c_k u^(k-1) and r(u) = sum_k c_k/(k+1) u^(k-1)
+            q, dq, r = np.zeros(len(u)), np.zeros(len(u)), np.zeros(len(u))
+            for k in range(c.shape[1], 0, -1):
+                dq = dq*u + q
+                q = q*u + c[:,k-1]
+                r = r*u + c[:,k-1]/(k+1)
+            integrals[self.poly] += u*u*r
+            delays[self.poly] += u*q
+            derivatives[self.poly] = q + u*dq
+        if len(self.hyper) > 0:
+            u, k1, k2 = x[self.hyper], self.ks[:,0], self.ks[:,1]
+            integrals[self.hyper] += k1*(np.log(k2/(k2-u)) - u/k2)
+            delays[self.hyper] += k1/(k2-u) - k1/k2
+            derivatives[self.hyper] = k1/(k2-u)**2
+        return integrals, delays, derivatives
+        
+    def delays(self, flows):
+        """Delays of the links at the link flows, see evaluate"""
+        return self.evaluate(flows)[1]
+        
+    def integrals(self, flows):
+        """Integrals of the delays from 0 to the link flows, see evaluate"""
+        return self.evaluate(flows)[0]
+        
+    def derivatives(self, flows):
+        """Derivatives of the delays at the link flows, see evaluate"""
+        return self.evaluate(flows)[2]
+        
+
 def create_delayfunc(type, parameters=None):
     """Create a Delay function of a specific type"""
     if type == 'None': return None
@@ -0,0 +1,218 @@
+'''
+Bush-based traffic assignment (Algorithm B)
+'''
+
+import numpy as np
+import logging
+from cvxopt import matrix
+from shortest_paths import shortest_path_tree
+import fw_solver as fw
+
+# bush flows below FLOW_EPS are considered zero
+FLOW_EPS = 1e-12
+
+
+def origins(arrays):
+    """Group the OD pairs by origin
+    
+    Return value
+    ------------
+    groups: list of (source, destinations, demands) with 0-based source and destinations
+    """
+    groups = []
+    for s in np.unique(arrays.origins):
+        k = np.where(arrays.origins == s)[0]
+        groups.append((s, arrays.destinations[k], arrays.demands[k]))
+    return groups
+
+
+class Network:
+    """Adjacency lists of the graph used in the loops over the bushes"""
+    def __init__(self, arrays):
+        self.arrays, self.numnodes, self.numlinks = arrays, arrays.numnodes, arrays.numlinks
+        self.startnodes, self.endnodes = arrays.startnodes.tolist(), arrays.endnodes.tolist()
+        out_ptr, out_links = arrays.out_ptr.tolist(), arrays.out_links.tolist()
+        in_ptr, in_links = arrays.in_ptr.tolist(), arrays.in_links.tolist()
+        self.out = [out_links[out_ptr[u]:out_ptr[u+1]] for u in range(self.numnodes)]
+        self.inn = [in_links[in_ptr[u]:in_ptr[u+1]] for u in range(self.numnodes)]
+
+
+class Bush:
+    """Bush of an origin: acyclic set of links rooted at the origin
+    that carries all the flow from the origin
+    
+    Attributes
+    ----------
+    origin: 0-based index of the origin
+    links: boolean mask of the links in the bush
+    x: flows from the origin on the links
+    order: nodes reachable from the origin in the bush in topological order
+    """
+    def __init__(self, arrays, origin, dests, demands, costs):
+        """Initialize with the all-or-nothing flows on the shortest path tree from origin"""
+        dist, pred, order = shortest_path_tree(arrays, costs, origin, forward=True)
+        if max([dist[d] for d in dests]) == np.inf:
+            logging.error('Node {} cannot reach some destinations'.format(origin+1))
+        self.origin, self.order = origin, order
+        self.links, self.x = np.zeros(arrays.numlinks, dtype=bool), np.zeros(arrays.numlinks)
+        startnodes = arrays.startnodes.tolist()
+        load = np.bincount(dests, weights=demands, minlength=arrays.numnodes).tolist()
+        for u in reversed(order):
+            k = pred[u]
+            if k < 0: continue
+            self.links[k] = True
+            self.x[k] += load[u]
+            load[startnodes[k]] += load[u]
+
+
+    def topological_sort(self, net):
+        """Update self.order with Kahn's algorithm on the links of the bush"""
+        links, endnodes = self.links.tolist(), net.endnodes
+        indeg = np.bincount(net.arrays.endnodes[self.links], minlength=net.numnodes).tolist()
+        order, stack = [], [self.origin]
+        while stack:
+            u = stack.pop()
+            order.append(u)
+            for k in net.out[u]:
+                if not links[k]: continue
+                v = endnodes[k]
+                indeg[v] -= 1
+                if indeg[v] == 0: stack.append(v)
+        self.order = order
+
+
+    def labels(self, net, c):
+        """Compute the min and max path labels from the origin in the bush
+        
+        Return value
+        ------------
+        L, minpred: min path costs and last links of the min paths
+        U: max path costs over all the links of the bush
+        V, maxpred: max path costs and last links of the max paths over the used links
+        """
+        m, startnodes = net.numnodes, net.startnodes
+        links, used = self.links.tolist(), (self.x > FLOW_EPS).tolist()
+        L, U, V = [np.inf]*m, [-np.inf]*m, [-np.inf]*m
+        minpred, maxpred = [-1]*m, [-1]*m
+        o = self.origin
+        L[o], U[o], V[o] = 0.0, 0.0, 0.0
+        for v in self.order[1:]:
+            for k in net.inn[v]:
+                if not links[k]: continue
+                u, ck = startnodes[k], c[k]
+                if L[u] + ck < L[v]: L[v], minpred[v] = L[u] + ck, k
+                if U[u] + ck > U[v]: U[v] = U[u] + ck
+                if used[k] and V[u] + ck > V[v]: V[v], maxpred[v] = V[u] + ck, k
+        return L, minpred, U, V, maxpred
+
+
+    def improve(self, net, c):
+        """Remove the unused links that are not in the min path tree
+        and add the links that are shortcuts for the max paths (Dial, 2006)
+        
+        Return value
+        ------------
+        number of links added to the bush
+        """
+        L, minpred, U, V, maxpred = self.labels(net, c)
+        keep = self.x > FLOW_EPS
+        keep[[k for k in minpred if k >= 0]] = True
+        self.links &= keep
+        self.topological_sort(net)
+        U = np.array(self.labels(net, c)[2])
+        Us, Ue = U[net.startnodes], U[net.endnodes]
+        new = ~self.links & (Us > -np.inf) & (Us + c < Ue)
+        if new.any():
+            self.links |= new
+            self.topological_sort(net)
+        return new.sum()
+
+
+    def equilibrate(self, net, l, c, dc, update):
+        """Shift flow from the max path to the min path towards each node
+        with a Newton step, l, c, dc are updated in place
+        
+        Parameters
+        ----------
+        net: Network object
+        l: link flows
+        c, dc: link costs and their derivatives at l
+        update: update(k) updates c[k], dc[k] after a change of l[k]
+        """
+        L, minpred, U, V, maxpred = self.labels(net, c)
+        startnodes, x = net.startnodes, self.x
+        pos = [0]*net.numnodes
+        for i,u in enumerate(self.order): pos[u] = i
+        for j in reversed(self.order):
+            ka, kb = minpred[j], maxpred[j]
+            if kb < 0 or ka == kb: continue
+            mins, maxs = [ka], [kb]
+            a, b = startnodes[ka], startnodes[kb]
+            while a != b:
+                if pos[a] > pos[b]: k = minpred[a]; mins.append(k); a = startnodes[k]
+                else: k = maxpred[b]; maxs.append(k); b = startnodes[k]
+            dcost = c[maxs].sum() - c[mins].sum()
+            if dcost <= 0.0: continue
+            deriv = dc[maxs].sum() + dc[mins].sum()
+            dx = x[maxs].min()
+            if deriv > 0.0: dx = min(dx, dcost/deriv)
+            x[maxs] = np.maximum(x[maxs] - dx, 0.0)
+            x[mins] += dx
+            l[maxs] -= dx
+            l[mins] += dx
+            update(mins + maxs)
+
+
+def solver(graph, update=False, full=False, SO=False, max_iter=100, rgap=1e-10, sweeps=5):
+    """Find the UE link flow with Algorithm B (Dial, 2006)
+    the flow from each origin is kept on an acyclic bush and equilibrated
+    by shifting flow from max paths to min paths
+    
+    Parameters
+    ----------
+    graph: graph object
+    update: if update==True: update link flows and link,path delays in graph
+    full: if True, also return the flows per origin
+    SO: if True, find the SO link flow
+    max_iter: maximum number of iterations over all the bushes
+    rgap: stop when the relative gap c'(l-y)/c'l is below rgap,
+    where c are the (marginal) delays at l and y the all-or-nothing flows
+    sweeps: number of extra sweeps of flow shifts over all the bushes per iteration
+    
+    Return value
+    ------------
+    linkflows: link flows
+    xs: if full, xs[o] = link flows from the origin o
+    """
+    arrays = graph.get_arrays()
+    type = arrays.delaytype
+    if type not in ['Polynomial', 'Hyperbolic']:
+        logging.error('Delay functions must be all polynomial or all hyperbolic'); return
+    ks, net = fw.get_ks(arrays, SO), Network(arrays)
+    c = fw.evaluate(ks, type, np.zeros(arrays.numlinks), SO)[1]
+    bushes = [Bush(arrays, s, ds, dem, c) for s,ds,dem in origins(arrays)]
+    groups = fw.destinations(arrays)
+
+    def update_costs(k): f, c[k], dc[k] = fw.evaluate(ks[k], type, l[k], SO)
+
+    for it in range(max_iter):
+        l = np.sum([bush.x for bush in bushes], axis=0)
+        f, c, dc = fw.evaluate(ks, type, l, SO)
+        y = fw.all_or_nothing(arrays, c, groups)
+        gap = np.dot(c, l-y) / np.dot(c, l)
+        logging.debug('Algorithm B iteration {}: objective {}, relative gap {}'.format(it, f.sum(), gap))
+        if gap < rgap: break
+        for bush in bushes:
+            bush.improve(net, c)
+            bush.equilibrate(net, l, c, dc, update_costs)
+        for i in range(sweeps):
+            for bush in bushes: bush.equilibrate(net, l, c, dc, update_costs)
+    logging.info('Algorithm B: {} iterations, relative gap {}'.format(it+1, gap))
+    linkflows = matrix(l)
+
+    if update:
+        logging.info('Update link flows, delays in Graph.'); graph.update_linkflows_linkdelays(linkflows)
+        logging.info('Update path delays in Graph.'); graph.update_pathdelays()
+
+    if full: return linkflows, {bush.origin+1: matrix(bush.x) for bush in bushes}
+    return linkflows
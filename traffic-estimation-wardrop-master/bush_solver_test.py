@@ -0,0 +1,73 @@
+'''
+Bush-based traffic assignment tests
+'''
+
+import numpy as np
+import ue_solver as ue
+import bush_solver as bush
+import path_solver as path
+from generate_graph import small_example, los_angeles
+from generate_paths import get_path_set, add_path_set
+from cvxopt import matrix
+import time
+
+
+def test1():
+    graph = small_example()
+    l, xs = bush.solver(graph, full=True)
+    print 'UE flow (cvxopt, Algorithm B, from origins 1 and 2): '
+    print matrix([[ue.solver(graph)], [l], [xs[1]], [xs[2]]])
+
+
+def test2(delaytype, SO=False):
+    """Compare ue.solver with Algorithm B on los_angeles"""
+    if delaytype == 'Polynomial': theta = matrix([0.0, 0.0, 0.0, 0.15, 0.0, 0.0])
+    if delaytype == 'Hyperbolic': theta = (3.5, 3.0)
+    for g in los_angeles(theta, delaytype):
+        start = time.clock()
+        l = ue.solver(g, SO=SO)
+        t1 = time.clock() - start
+        start = time.clock()
+        l2 = bush.solver(g, SO=SO)
+        t2 = time.clock() - start
+        error = np.linalg.norm(l-l2, 1) / np.linalg.norm(l, 1)
+        print 'ue.solver: {:.2f}s, Algorithm B: {:.2f}s, error {:.1e}'.format(t1, t2, error)
+
+
+
+def test3(delaytype, SO=False, K=10):
+    """Compare path.solver on the K shortest paths with Algorithm B on los_angeles"""
+    if delaytype == 'Polynomial': theta = matrix([0.0, 0.0, 0.0, 0.15, 0.0, 0.0])
+    if delaytype == 'Hyperbolic': theta = (3.5, 3.0)
+    for g in los_angeles(theta, delaytype):
+        add_path_set(g, get_path_set(g, K, 1))
+        l = path.solver(g, SO=SO)[1]
+        l2 = bush.solver(g, SO=SO)
+        error = np.linalg.norm(l-l2, 1) / np.linalg.norm(l2, 1)
+        print 'path.solver against Algorithm B: error {:.1e}'.format(error)
+
+
+def test4():
+    """Compare path.gradient_projection with Algorithm B on small_example"""
+    graph = small_example()
+    x, l = path.gradient_projection(graph)
+    l2 = bush.solver(graph)
+    print 'UE flow (gradient projection, Algorithm B): '
+    print matrix([[l], [l2]])
+    error = np.linalg.norm(l-l2, 1) / np.linalg.norm(l2, 1)
+    assert error < 1e-4, 'gradient projection: error {:.1e}'.format(error)
+    P = path.linkpath_incidence(graph)
+    assert np.linalg.norm(P*x - l, 1) < 1e-8*np.linalg.norm(l, 1), 'path flows'
+
+
+def main():
+    test1()
+    test4()
+    #test2('Polynomial')
+    #test2('Hyperbolic')
+    #test2('Polynomial', True)
+    #test3('Hyperbolic', True)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,8 @@ Experiments for ECC 2015
 
 
 import numpy as np
-import ue_solver as ue
+from multiprocessing import cpu_count
+import bush_solver as bush
 import inverse_opt as invopt
 from generate_graph import los_angeles
 import matplotlib.pyplot as plt
@@ -37,11 +38,12 @@ def experiment_estimation(indlinks_obs, delaytype, degree):
     if delaytype == 'Polynomial': true_theta = coef
     if delaytype == 'Hyperbolic': true_theta = (a,b)
     g1, g2, g3, g4 = los_angeles(true_theta, delaytype)
-    x1, x2, x3, x4 = ue.solver(g1), ue.solver(g2), ue.solver(g3), ue.solver(g4)
+    x1, x2, x3, x4 = bush.solver(g1), bush.solver(g2), bush.solver(g3), bush.solver(g4)
     obs = [g1.indlinks[id] for id in indlinks_obs]
     obs = [int(i) for i in list(np.sort(obs))]
     w_multi = [0.001, .01, .1, .5, .9, .99, 0.999] # weight on the observation residual
-    r_gap, r_obs, x_est, thetas = invopt.multi_objective_solver([g1,g2,g3,g4], [x1[obs],x2[obs],x3[obs],x4[obs]], obs, degree, w_multi)
+    r_gap, r_obs, x_est, thetas = invopt.multi_objective_solver([g1,g2,g3,g4], [x1[obs],x2[obs],x3[obs],x4[obs]], obs, degree, w_multi,
+                                                                processes=min(len(w_multi), cpu_count()))
     print r_gap
     print r_obs
     u = matrix([x1,x2,x3,x4])
@@ -51,7 +53,7 @@ def experiment_estimation(indlinks_obs, delaytype, degree):
     
     
     
-def experiment_toll_pricing(ws_so, ws_toll):
+def experiment_toll_pricing(ws_so, ws_toll, path=None):
     """Demonstrate multi-objective optimization for toll pricing model
     1. Generate the graph of L.A.
     2. Run multi-objective solver
@@ -62,9 +64,12 @@ def experiment_toll_pricing(ws_so, ws_toll):
     ----------
     ws_so: list of weights for so objective
     ws_toll: list of weight for toll objective
+    path: if given, file of the results of each point, see tp.toll_grid
     """
     graph = los_angeles(coef, 'Polynomial')[3]
-    r_gap, toll_est, loss_est, toll_res, loss_res, toll = tp.multi_objective_solver(graph, coef, ws_so, ws_toll)
+    processes = min(len(ws_so)*len(ws_toll), cpu_count()) # one process per point of the grid
+    r_gap, toll_est, loss_est, toll_res, loss_res, toll = tp.multi_objective_solver(graph, coef, ws_so, ws_toll,
+                                                                                   processes=processes, path=path)
     for i in range(len(ws_so)):
         for j in range(len(ws_toll)):
             if r_gap[i,j] < 0.0: r_gap[i,j]=0.0
@@ -0,0 +1,206 @@
+'''
+Frank-Wolfe traffic assignment
+'''
+
+import numpy as np
+import logging
+from cvxopt import matrix
+from util import bisection
+from ue_solver import horner
+from shortest_paths import shortest_path_tree
+
+# fraction of the capacity k2 above which hyperbolic objectives are extended by
+# their second order Taylor expansion, so that all-or-nothing loads are finite
+HYPER_CAP = 0.99
+# bound on the weight of the previous directions in the conjugate directions
+DELTA = 1e-5
+
+
+def get_ks(arrays, SO=False):
+    """Get the parameters of the separable objective sum_i f_i(l_i) of the assignment
+    f_i is the integral of the delay on link i (UE) or l_i*delay_i(l_i) (SO)
+    
+    Parameters
+    ----------
+    arrays: GraphArrays object from graph.get_arrays()
+    SO: if True, objective of the system optimum
+    
+    Return value
+    ------------
+    ks: if Polynomial, ks[i,k-1] is the coefficient of u^k in f_i
+    if Hyperbolic, ks[i,:] = (ffdelay-k1/k2, k1, k2) for link i
+    """
+    if arrays.delaytype == 'Polynomial':
+        coefs = arrays.coefs
+        if not SO: coefs = coefs / np.arange(2.0, coefs.shape[1]+2)
+        return np.column_stack((arrays.ffdelays, coefs))
+    if arrays.delaytype == 'Hyperbolic':
+        k1, k2 = arrays.ks[:,0], arrays.ks[:,1]
+        return np.column_stack((arrays.ffdelays - k1/k2, k1, k2))
+
+
+def hyperbolic(ks, l, SO=False):
+    """Evaluate f_i, f_i', f_i'' at l for hyperbolic delays, see ue_solver.objective_hyper
+    and ue_solver.objective_hyper_SO, above HYPER_CAP*k2 f_i is extended by its
+    second order Taylor expansion"""
+    a, k1, k2 = ks[:,0], ks[:,1], ks[:,2]
+    u = np.minimum(l, HYPER_CAP*k2)
+    r = 1.0/(k2-u)
+    if SO: f, df, d2f = a*u + k1*u*r, a + k1*r + k1*u*r**2, 2.0*k1*r**2 + 2.0*k1*u*r**3
+    else: f, df, d2f = a*u - k1*np.log(k2-u), a + k1*r, k1*r**2
+    e = l - u
+    return f + (df + 0.5*d2f*e)*e, df + d2f*e, d2f
+
+
+def evaluate(ks, type, l, SO=False):
+    """Evaluate f_i, f_i', f_i'' at l for all links
+    f_i' is the delay (UE) or the marginal delay (SO) on link i
+    
+    Parameters
+    ----------
+    ks: parameters from get_ks
+    type: type of the delay functions
+    l: numpy array of link flows
+    SO: if True, objective of the system optimum
+    """
+    if type == 'Polynomial': return horner(ks, l)
+    if type == 'Hyperbolic': return hyperbolic(ks, l, SO)
+
+
+def destinations(arrays):
+    """Group the OD pairs by destination
+    
+    Return value
+    ------------
+    groups: list of (sink, origins, demands) with 0-based sink and origins
+    """
+    groups = []
+    for t in np.unique(arrays.destinations):
+        k = np.where(arrays.destinations == t)[0]
+        groups.append((t, arrays.origins[k], arrays.demands[k]))
+    return groups
+
+
+def all_or_nothing(arrays, costs, groups):
+    """Assign the demands to the shortest paths with respect to costs
+    using one shortest path tree per destination
+    
+    Parameters
+    ----------
+    arrays: GraphArrays object from graph.get_arrays()
+    costs: numpy array of link costs
+    groups: OD pairs grouped by destination from destinations(arrays)
+    
+    Return value
+    ------------
+    y: numpy array of link flows
+    """
+    y, m = np.zeros(arrays.numlinks), arrays.numnodes
+    endnodes = arrays.endnodes.tolist()
+    for sink, origins, demands in groups:
+        dist, next, order = shortest_path_tree(arrays, costs, sink, origins)
+        if max([dist[o] for o in origins]) == np.inf:
+            logging.error('Some origins cannot reach node {}'.format(sink+1))
+        load = np.bincount(origins, weights=demands, minlength=m).tolist()
+        for u in reversed(order):
+            k = next[u]
+            if k < 0 or load[u] == 0.0: continue
+            y[k] += load[u]
+            load[endnodes[k]] += load[u]
+    return y
+
+
+def conjugate(l, y, s, h):
+    """Target of the conjugate direction, see Mitradjieva and Lindberg (2013)
+    
+    Parameters
+    ----------
+    l: current link flows
+    y: all-or-nothing link flows
+    s: target of the previous direction
+    h: f''(l), the diagonal of the hessian
+    """
+    hs = h*(s-l)
+    num, den = np.dot(hs, y-l), np.dot(hs, y-s)
+    alpha = num/den if den != 0.0 else 0.0
+    alpha = min(max(alpha, 0.0), 1.0-DELTA)
+    return alpha*s + (1.0-alpha)*y
+
+
+def biconjugate(l, y, s1, s2, tau, h):
+    """Target of the bi-conjugate direction, see Mitradjieva and Lindberg (2013)
+    
+    Parameters
+    ----------
+    l: current link flows
+    y: all-or-nothing link flows
+    s1, s2: targets of the two previous directions
+    tau: previous step size
+    h: f''(l), the diagonal of the hessian
+    """
+    u, v = tau*s1 + (1.0-tau)*s2 - l, s1 - l
+    den = np.dot(h*u, s2-s1)
+    mu = max(-np.dot(h*u, y-l)/den, 0.0) if den != 0.0 else 0.0
+    den = np.dot(h*v, v)
+    nu = max(-np.dot(h*v, y-l)/den + mu*tau/(1.0-tau), 0.0) if den != 0.0 else 0.0
+    return (y + nu*s1 + mu*s2) / (1.0+nu+mu)
+
+
+def line_search(ks, type, l, d, SO=False, tol=1e-8):
+    """Exact line search min_{0<=a<=1} f(l+a*d) by bisection on the directional derivative"""
+    def F(a): return np.dot(evaluate(ks, type, l+a*d, SO)[1], d)
+    if F(0.0) >= 0.0: return 0.0
+    if F(1.0) <= 0.0: return 1.0
+    return bisection(F, 0.0, 0.0, 1.0, tol)
+
+
+def solver(graph, update=False, SO=False, method='BFW', max_iter=1000, rgap=1e-4, full=False, l0=None):
+    """Find the UE link flow with the Frank-Wolfe algorithm
+    all-or-nothing loading on shortest path trees and exact line search,
+    does not build the multi-commodity program of ue_solver.solver
+    
+    Parameters
+    ----------
+    graph: graph object
+    update: if update==True: update link flows and link,path delays in graph
+    SO: if True, find the SO link flow
+    method: 'FW' (Frank-Wolfe), 'CFW' (conjugate) or 'BFW' (bi-conjugate Frank-Wolfe)
+    max_iter: maximum number of iterations
+    rgap: stop when the relative gap c'(l-y)/c'l is below rgap,
+    where c are the (marginal) delays at l and y the all-or-nothing flows
+    full: if True, also return the relative gaps of the iterations
+    l0: if given, feasible link flows (e.g. from a previous solve with the same demands)
+    used as starting point instead of the all-or-nothing flows at free flow
+    """
+    arrays = graph.get_arrays()
+    type = arrays.delaytype
+    if type not in ['Polynomial', 'Hyperbolic']:
+        logging.error('Delay functions must be all polynomial or all hyperbolic'); return
+    ks, groups = get_ks(arrays, SO), destinations(arrays)
+    if l0 is None: l = all_or_nothing(arrays, evaluate(ks, type, np.zeros(arrays.numlinks), SO)[1], groups)
+    else: l = np.array(l0, dtype=float).ravel()
+    s1, s2, tau, gaps = None, None, 0.0, []
+    for it in range(max_iter):
+        f, c, h = evaluate(ks, type, l, SO)
+        y = all_or_nothing(arrays, c, groups)
+        gaps.append(np.dot(c, l-y) / np.dot(c, l))
+        logging.debug('FW iteration {}: objective {}, relative gap {}'.format(it, f.sum(), gaps[-1]))
+        if gaps[-1] < rgap: break
+        s = y
+        if method == 'CFW' and s1 is not None: s = conjugate(l, y, s1, h)
+        if method == 'BFW' and s1 is not None:
+            if s2 is None or tau >= 1.0: s = conjugate(l, y, s1, h)
+            else: s = biconjugate(l, y, s1, s2, tau, h)
+        if np.dot(c, s-l) >= 0.0: s = y # not a descent direction
+        tau = line_search(ks, type, l, s-l, SO)
+        l = l + tau*(s-l)
+        s1, s2 = s, s1
+    logging.info('FW: {} iterations, relative gap {}'.format(it+1, gaps[-1]))
+    linkflows = matrix(l)
+
+    if update:
+        logging.info('Update link flows, delays in Graph.'); graph.update_linkflows_linkdelays(linkflows)
+        logging.info('Update path delays in Graph.'); graph.update_pathdelays()
+
+    if full: return linkflows, gaps
+    return linkflows
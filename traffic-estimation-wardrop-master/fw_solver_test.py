@@ -0,0 +1,44 @@
+'''
+Frank-Wolfe traffic assignment tests
+'''
+
+import numpy as np
+import ue_solver as ue
+import fw_solver as fw
+from generate_graph import small_example, los_angeles
+from cvxopt import matrix
+import time
+
+
+def test1():
+    graph = small_example()
+    l1, l2 = ue.solver(graph), fw.solver(graph, rgap=1e-8)
+    print 'UE flow (cvxopt, Frank-Wolfe): '
+    print matrix([[l1], [l2]])
+
+
+def test2(delaytype, SO=False):
+    """Compare ue.solver with FW, CFW and BFW on los_angeles"""
+    if delaytype == 'Polynomial': theta = matrix([0.0, 0.0, 0.0, 0.15, 0.0, 0.0])
+    if delaytype == 'Hyperbolic': theta = (3.5, 3.0)
+    g = los_angeles(theta, delaytype)[3]
+    start = time.clock()
+    l = ue.solver(g, SO=SO)
+    print 'ue.solver: {:.2f}s'.format(time.clock() - start)
+    for method in ['FW', 'CFW', 'BFW']:
+        start = time.clock()
+        l2, gaps = fw.solver(g, SO=SO, method=method, full=True)
+        error = np.linalg.norm(l-l2, 1) / np.linalg.norm(l, 1)
+        print '{}: {:.2f}s, {} iterations, relative gap {:.1e}, error {:.1e}'.format(method,
+                time.clock() - start, len(gaps), gaps[-1], error)
+
+
+def main():
+    test1()
+    #test2('Polynomial')
+    #test2('Hyperbolic')
+    #test2('Polynomial', True)
+
+
+if __name__ == '__main__':
+    main()
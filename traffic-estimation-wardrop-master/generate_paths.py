@@ -11,6 +11,7 @@ from cvxopt import matrix
 from generate_graph import los_angeles
 import shortest_paths as sh
 from path_solver import linkpath_incidence
+from multiprocessing import Pool, cpu_count
 import pickle
 
 theta = matrix([0.0, 0.0, 0.0, 0.15])
@@ -32,15 +33,78 @@ def test_helper(demand, paths):
     return l1,l2,l3,l4,d1,d2,d3,d4
     
     
-def get_shortest_paths(g, K):
+ksp_data = {} # graph and link delays shared with the workers of get_path_set
+
+
+def ksp_init(graph, delays):
+    """Initializer of the workers of get_path_set"""
+    ksp_data['graph'], ksp_data['delays'] = graph, delays
+
+
+def ksp_helper(task):
+    """Helper function for get_path_set: K-shortest paths from sources to sink"""
+    sink, sources, K = task
+    return sink, sh.mainKSP(ksp_data['graph'], sources, sink, K, ksp_data['delays'])
+
+
+def get_path_set(graph, K, processes=None, delays=None):
+    """Get the K-shortest paths for every OD pair in graph.ODs
+    with one KSP task per destination run across a pool of processes
+    
+    Parameters:
+    -----------
+    graph: Graph object
+    K: number of shortest paths
+    processes: number of processes, if None use all the cores, if 1 run sequentially
+    delays: numpy array of link delays indexed by graph.indlinks, if None use the current delays
+    
+    Return value:
+    ------------
+    paths: dictionary s.t. paths[(o,d)] = list of distinct paths from o to d,
+    each path is a list of link ids that can be passed to graph.add_path
+    """
+    if delays is None: delays = sh.link_delays(graph)
+    if processes is None: processes = cpu_count()
+    arrays = graph.get_arrays() # built before forking, shared by the workers
+    sinks = {}
+    for o,d in graph.ODs.keys(): sinks.setdefault(d, []).append(o)
+    tasks = [(t, sources, K) for t,sources in sinks.items()]
+    ksp_init(graph, delays)
+    if processes > 1 and len(tasks) > 1:
+        pool = Pool(min(processes, len(tasks)), ksp_init, (graph, delays))
+        try: results = list(pool.imap_unordered(ksp_helper, tasks))
+        finally: pool.close(); pool.join()
+    else: results = map(ksp_helper, tasks)
+    paths = {}
+    for t,As in results:
+        for s,node_paths in As.items():
+            link_paths, seen = [], set()
+            for nodes in node_paths:
+                link_ids = []
+                for u,v in zip(nodes[:-1], nodes[1:]):
+                    ks = sh.edge_links(arrays, u-1, v-1)
+                    link_ids.append(arrays.link_ids[ks[np.argmin(delays[ks])]])
+                if tuple(link_ids) not in seen: seen.add(tuple(link_ids)); link_paths.append(link_ids)
+            paths[(s,t)] = link_paths
+    return paths
+
+
+def add_path_set(graph, paths):
+    """Add the paths from get_path_set to the graph"""
+    for od in paths.keys():
+        for link_ids in paths[od]: graph.add_path(link_ids)
+
+
+def get_shortest_paths(g, K, processes=1):
     """Get the K-shortest paths for all the OD pairs in the graph with current delay
+    
+    Return value:
+    ------------
+    paths: list of paths, each path is a list of nodes
     """
     paths = []
-    for sink in [5,20,22]:
-        sources = [od[0] for od in g.ODs.keys() if od[1]==sink]
-        As = sh.mainKSP(g, sources, sink, K)
-        for s in sources:
-            for p in As[s]: paths.append(p)
+    for link_paths in get_path_set(g, K, processes).values():
+        for link_ids in link_paths: paths.append([link_ids[0][0]] + [id[1] for id in link_ids])
     return paths
     
 
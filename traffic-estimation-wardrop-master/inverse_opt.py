@@ -7,8 +7,13 @@ import ue_solver as ue
 import numpy as np
 from cvxopt import matrix, spmatrix, solvers, mul, spdiag
 from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
 import shortest_paths as sh
 import rank_nullspace as rn
+import logging
+import time
+from kktsolver import get_kktsolver, kkt_blocks
+from Graph import DelayModel
 
 
 def get_data(graphs):
@@ -48,22 +53,35 @@ def constraints(data, ls, degree):
     N, n = len(beqs), len(ffdelays)
     p = Aeq.size[1]/n
     m = Aeq.size[0]/p
-    b = matrix([ffdelays]*p*N)
-    tmp1, tmp2 = matrix(0.0, (degree, 1)), matrix(0.0, (p*N*n, degree))
-    tmp3, tmp4 = matrix(0.0, (p*n*N, m*N*p)), matrix(0.0, (p*m*N, 1))
-    for j, beq, linkflows in zip(range(N), beqs, ls): 
-        tmp5 = mul(slopes, linkflows)
-        for deg in range(degree):
-            tmp6 = mul(tmp5**(deg+1), ffdelays)
-            tmp1[deg] += (linkflows.T) * tmp6
-            tmp2[j*n*p:(j+1)*n*p, deg] = -matrix([tmp6]*p)
-        tmp3[j*n*p:(j+1)*n*p, j*m*p:(j+1)*m*p] = Aeq.T
-        tmp4[j*m*p:(j+1)*m*p, 0] = -beq
-                    
-    c, A = matrix([tmp1, tmp4]), matrix([[tmp2], [tmp3]])
-    A = matrix([A, spmatrix(-1.0, range(degree), range(degree), (degree, degree+m*N*p))])
-    b = matrix([b, matrix([0.0]*degree)])
-    return c, A, b
+    ffd, s = np.array(ffdelays).ravel(), np.array(slopes).ravel()
+    c, rows, cols, values = [matrix(0.0, (degree,1))], [], [], []
+    I, J, V = np.array(Aeq.I).ravel(), np.array(Aeq.J).ravel(), np.array(Aeq.V).ravel()
+    for j, beq, linkflows in zip(range(N), beqs, ls):
+        l = np.array(linkflows).ravel()
+        T = ffd[:,None] * np.power((s*l)[:,None], np.arange(1, degree+1))
+        c[0] += matrix(np.dot(l, T))
+        c.append(-beq)
+        # block j: -[T]*p on the coefficients and Aeq.T on the dual variables of observation j
+        r = j*n*p + np.arange(n*p)
+        rows += [np.repeat(r, degree), J + j*n*p]
+        cols += [np.tile(np.arange(degree), n*p), I + degree + j*m*p]
+        values += [-np.tile(T, (p,1)).ravel(), V]
+    rows.append(np.arange(degree) + N*n*p)
+    cols.append(np.arange(degree))
+    values.append(-np.ones(degree))
+    A = spmatrix(np.concatenate(values), np.concatenate(rows), np.concatenate(cols), (N*n*p+degree, degree+m*N*p))
+    b = matrix([matrix([ffdelays]*p*N), matrix([0.0]*degree)])
+    return matrix(c), A, b
+
+
+def lp_blocks(data, N, degree):
+    """Rows and columns of the observations in the LP of constraints(data, ls, degree)
+    the coefficients are the first degree variables, see kktsolver.kkt_blocks"""
+    Aeq, ffdelays = data[0], data[2]
+    n = len(ffdelays)
+    p = Aeq.size[1]/n
+    m = Aeq.size[0]/p
+    return [(range(j*n*p, (j+1)*n*p), range(degree+j*m*p, degree+(j+1)*m*p)) for j in range(N)]
 
 
 def solver(data, ls, degree, full=False):
@@ -77,14 +95,14 @@ def solver(data, ls, degree, full=False):
     full: if False, just return theta, if True, return the whole primal solution
     """
     c, A, b = constraints(data, ls, degree)
-    print A.size
-    r = rn.rank(matrix(A))
-    print r
-    if full: return solvers.lp(c, G=A, h=b)['x']
-    return solvers.lp(c, G=A, h=b)['x'][range(degree)]
+    dims = {'l': A.size[0], 'q': [], 's': []}
+    kktsolver = kkt_blocks(A, dims, degree, lp_blocks(data, len(ls), degree))
+    x = solvers.lp(c, G=A, h=b, kktsolver=kktsolver)['x']
+    if full: return x
+    return x[range(degree)]
 
 
-def x_solver(ffdelays, coefs, Aeq, beq, w_obs=0.0, obs=None, l_obs=None, w_gap=1.0):
+def x_solver(ffdelays, coefs, Aeq, beq, w_obs=0.0, obs=None, l_obs=None, w_gap=1.0, x0=None, full=False):
     """
     optimization w.r.t. x_block:
     min F(x)'x + r(x) s.t. x in K
@@ -98,14 +116,23 @@ def x_solver(ffdelays, coefs, Aeq, beq, w_obs=0.0, obs=None, l_obs=None, w_gap=1
     obs: indices of the observed links
     l_obs: observations
     w_gap: weight on the gap function
+    x0: if given, previous x used as warm start (see ue.warm_start)
+    full: if True, also return x (link flows per destination), None if cp did not converge
     """
     n = len(ffdelays)
     p = Aeq.size[1]/n    
     A, b = spmatrix(-1.0, range(p*n), range(p*n)), matrix(0.0, (p*n,1))
-    def F(x=None, z=None): return ue.objective_poly(x, z, matrix([[ffdelays], [coefs]]), p, w_obs, obs, l_obs, w_gap)
-    x = solvers.cp(F, G=A, h=b, A=Aeq, b=beq)['x']
+    if x0 is not None: x0, A = ue.warm_start(x0, Aeq, beq)
+    ks = np.array(matrix([[ffdelays], [coefs]]))
+    def F(x=None, z=None):
+        if x is None and x0 is not None: return 0, x0
+        return ue.objective_poly(x, z, ks, p, w_obs, obs, l_obs, w_gap)
+    dims = {'l': p*n, 'q': [], 's': []}
+    sol = solvers.cp(F, G=A, h=b, A=Aeq, b=beq, kktsolver=get_kktsolver(A, dims, Aeq, F, p))
+    x = sol['x']
     linkflows = matrix(0.0, (n,1))
     for k in range(p): linkflows += x[k*n:(k+1)*n]
+    if full: return linkflows, (x if sol['status'] == 'optimal' else None)
     return linkflows
 
 
@@ -154,15 +181,12 @@ def compute_coefs(ffdelays, slopes, theta):
     slopes: matrix of slopes from graph.get_slopes()
     theta: parameters
     """
-    n, d = len(ffdelays), len(theta)
-    coefs = matrix(0.0, (n,d))
-    for i in range(n):
-        coef = [ffdelays[i]*a*b for a,b in zip(theta, np.power(slopes[i], range(1,d+1)))]
-        coefs[i,:] = matrix(coef).T
-    return coefs
+    ffd, s = np.array(ffdelays).ravel(), np.array(slopes).ravel()
+    theta = np.array(theta, dtype=float).ravel()
+    return matrix(ffd[:,None] * theta * np.power(s[:,None], np.arange(1, len(theta)+1)))
 
 
-def solver_mis(data, ls_obs, obs, degree, w_obs=1000.0, max_iter=3, full=False, w_gap=1.0):
+def solver_mis(data, ls_obs, obs, degree, w_obs=1000.0, max_iter=3, full=False, w_gap=1.0, warm=True, pool=None, xs=None):
     """Solves the inverse optimization problem with missing values
     
     Parameters
@@ -175,15 +199,26 @@ def solver_mis(data, ls_obs, obs, degree, w_obs=1000.0, max_iter=3, full=False,
     max_iter: maximum number of iterations
     full: if False, just return thetam if True, return theta, ys, ls
     w_gap: weight on the gap function
+    warm: if True, warm start x_solver with its solution at the previous iteration
+    pool: if given, XSolverPool of the graph solving the N x_solver problems in parallel
+    xs: if given, list of N warm starts for x_solver (e.g. from a close w_obs, w_gap),
+    updated in place with the last solutions if warm is True
     """
     Aeq, beqs, ffdelays, slopes = data
     N, n = len(beqs), len(ffdelays)
     p = Aeq.size[1]/n
     m = Aeq.size[0]/p
     theta = matrix(np.zeros(degree)); theta[0] = 1.0 # initial theta
+    ls = [None]*N
+    if xs is None: xs = [None]*N
     for k in range(max_iter):
         coefs = compute_coefs(ffdelays, slopes, theta)
-        ls = [x_solver(ffdelays, coefs, Aeq, beqs[j], w_obs, obs, ls_obs[j], w_gap) for j in range(N)]
+        if pool is None:
+            sols = [x_solver(ffdelays, coefs, Aeq, beqs[j], w_obs, obs, ls_obs[j], w_gap, xs[j], True) for j in range(N)]
+        else: sols = pool.x_solver(coefs, beqs, w_obs, obs, ls_obs, w_gap, xs)
+        for j, (l, x) in enumerate(sols):
+            ls[j] = l
+            if warm: xs[j] = x
         theta = solver(data, ls, degree)
     if full:
         sol = solver(data, ls, degree, True)
@@ -205,10 +240,78 @@ for j in range(N):
 """
 
 
-def smm_helper(data):
-    """Helper function for solver_mis_multi"""
-    ffdelays, coefs, Aeq, beq, soft, obs, l_obs = data
-    return x_solver(ffdelays, coefs, Aeq, beq, soft, obs, l_obs)
+# Aeq and ffdelays of the graph in each process of an XSolverPool, set by init_worker
+worker = {}
+
+
+def shared_array(typecode, values):
+    """Copy a numpy array into a multiprocessing.RawArray"""
+    values = np.asarray(values).ravel()
+    array = RawArray(typecode, len(values))
+    np.frombuffer(array, dtype=values.dtype)[:] = values
+    return array
+
+
+def init_worker(I, J, V, size, ffdelays):
+    """Rebuild Aeq and ffdelays from the shared memory of the pool, once per process"""
+    I, J = np.frombuffer(I, dtype=int), np.frombuffer(J, dtype=int)
+    worker['Aeq'] = spmatrix(np.frombuffer(V), I, J, size)
+    worker['ffdelays'] = matrix(np.frombuffer(ffdelays))
+
+
+def x_task(args):
+    """Solve x_solver for one observation in a worker of an XSolverPool"""
+    coefs, beq, w_obs, obs, l_obs, w_gap, x0 = args
+    return x_solver(worker['ffdelays'], coefs, worker['Aeq'], beq, w_obs, obs, l_obs, w_gap, x0, True)
+
+
+def ue_task(args):
+    """Solve ue.solver for one observation in a worker of an XSolverPool"""
+    coefs, beq = args
+    return ue.solver(data=(worker['Aeq'], beq, worker['ffdelays'], coefs, 'Polynomial'))
+
+
+class XSolverPool:
+    """Persistent pool of processes for the per-observation x_solver and ue.solver problems
+    of graphs sharing the same Aeq and ffdelays (e.g. the graphs of get_data)
+    
+    Aeq and ffdelays are copied once in shared memory and read by each process
+    when it starts, the tasks only carry beq, l_obs, the warm start and the coefficients
+    
+    Parameters
+    ----------
+    Aeq: UE equality constraints
+    ffdelays: matrix of freeflow delays from graph.get_ffdelays()
+    processes: number of processes, if None use all the cores
+    """
+    def __init__(self, Aeq, ffdelays, processes=None):
+        shared = (shared_array('l', Aeq.I), shared_array('l', Aeq.J), shared_array('d', Aeq.V),
+                  Aeq.size, shared_array('d', ffdelays))
+        self.pool = Pool(processes=processes, initializer=init_worker, initargs=shared)
+        
+    def x_solver(self, coefs, beqs, w_obs, obs, ls_obs, w_gap=1.0, xs=None):
+        """Return [x_solver(ffdelays, coefs, Aeq, beqs[j], w_obs, obs, ls_obs[j], w_gap, xs[j], True)]"""
+        if xs is None: xs = [None]*len(beqs)
+        N = len(beqs)
+        return self.pool.map(x_task, zip([coefs]*N, beqs, [w_obs]*N, [obs]*N, ls_obs, [w_gap]*N, xs))
+        
+    def ue_solver(self, coefs, beqs):
+        """Return [ue.solver(data=(Aeq, beq, ffdelays, coefs, 'Polynomial')) for beq in beqs]"""
+        return self.pool.map(ue_task, [(coefs, beq) for beq in beqs])
+        
+    def submit(self, task, args):
+        """Run task(args) in a worker, return a multiprocessing.pool.AsyncResult"""
+        return self.pool.apply_async(task, (args,))
+        
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *args):
+        self.close()
 
 
 def solver_mis_multi_thread(data, ls_obs, obs, degree, soft=1000.0, max_iter=3, processes=1):
@@ -224,20 +327,11 @@ def solver_mis_multi_thread(data, ls_obs, obs, degree, soft=1000.0, max_iter=3,
     max_iter: maximum number of iterations
     processes: number of processes
     """
-    Aeq, beqs, ffdelays, slopes = data
-    N, n = len(beqs), len(ffdelays)
-    p = Aeq.size[1]/n
-    m = Aeq.size[0]/p
-    theta = matrix(np.zeros(degree)); theta[0] = 1.0 #initial theta
-    for k in range(max_iter):
-        coefs = compute_coefs(ffdelays, slopes, theta)
-        pool = Pool(processes=processes)
-        ls = pool.map(smm_helper, zip([ffdelays]*N, [coefs]*N, [Aeq]*N, beqs, [soft]*N, [obs]*N, ls_obs))
-        theta = solver(data, ls, degree)
-    return theta
+    with XSolverPool(data[0], data[2], processes) as pool:
+        return solver_mis(data, ls_obs, obs, degree, soft, max_iter, pool=pool)
 
 
-def main_solver(graphs, ls_obs, obs, degree, soft=1000.0, max_iter=3):
+def main_solver(graphs, ls_obs, obs, degree, soft=1000.0, max_iter=3, processes=1):
     """Solves solve_mis with the best parameter
     
     Parameters
@@ -248,19 +342,24 @@ def main_solver(graphs, ls_obs, obs, degree, soft=1000.0, max_iter=3):
     degree: degree of the polynomial function to estimate
     soft: regularization parameter for soft constraints
     max_iter: maximum number of iterations
+    processes: if > 1, number of processes of the XSolverPool solving the observations in parallel
     """
     data, n_obs = get_data(graphs), len(obs)
     Aeq, beqs, ffdelays, slopes = data
     type, N, min_e, n = 'Polynomial', len(beqs), np.inf, len(ffdelays)
-    if n_obs < n: theta = solver_mis(data, ls_obs, obs, degree, soft, max_iter)
-    #if n_obs < n: theta = solver_mis_multi_thread(data, ls_obs, obs, degree, i*np.ones(degree), soft, max_iter, 4)
-    if n_obs == n: theta = solver(data, ls_obs, degree)
-    coefs = compute_coefs(ffdelays, slopes, theta)
-    xs = [ue.solver(data=(Aeq, beqs[j], ffdelays, coefs, type)) for j in range(N)]
+    pool = XSolverPool(Aeq, ffdelays, processes) if processes > 1 else None
+    try:
+        if n_obs < n: theta = solver_mis(data, ls_obs, obs, degree, soft, max_iter, pool=pool)
+        if n_obs == n: theta = solver(data, ls_obs, degree)
+        coefs = compute_coefs(ffdelays, slopes, theta)
+        if pool is None: xs = [ue.solver(data=(Aeq, beqs[j], ffdelays, coefs, type)) for j in range(N)]
+        else: xs = pool.ue_solver(coefs, beqs)
+    finally:
+        if pool is not None: pool.close()
     return theta, xs
 
 
-def compute_scaling(graphs, ls_obs, obs, data):
+def compute_scaling(graphs, ls_obs, obs, data, pool=None):
     """Scale the objectives for multi-objective optimization
     
     Parameters
@@ -269,6 +368,7 @@ def compute_scaling(graphs, ls_obs, obs, data):
     ls_obs: list of observed links
     obs: indlinks ids of observed links
     data: obtained from get_data
+    pool: if given, XSolverPool of the graphs solving the ue programs in parallel
     
     Return value
     ------------
@@ -282,7 +382,8 @@ def compute_scaling(graphs, ls_obs, obs, data):
     theta = matrix([1.0]) #initial theta
     coefs = compute_coefs(ffdelays, slopes, theta)
     type = 'Polynomial'
-    xs = [ue.solver(data=(Aeq, beqs[k], ffdelays, coefs, type)) for k in range(N)]
+    if pool is None: xs = [ue.solver(data=(Aeq, beqs[k], ffdelays, coefs, type)) for k in range(N)]
+    else: xs = pool.ue_solver(coefs, beqs)
     scale[0] = 2.*np.linalg.norm(matrix(ls_obs)-matrix([x[obs] for x in xs]),2)**-2
     
     graph = graphs[0]
@@ -312,23 +413,82 @@ def compute_gap(ls, ys, ks, beqs, scale):
     beqs: list of ue constraints Aeq*x=beq
     scale: scaling factor for the gap function
     """
-    n, d = ks.size
+    model = DelayModel(ks[:,0], 'Polynomial', ks[:,1:])
     gap = 0.0
     for l,y,beq in zip(ls,ys,beqs):
-        gap -= beq.T*y
-        for i in range(n):
-            tmp = matrix(np.power(l[i],range(1,d+1)))
-            gap += ks[i,:] * tmp
-    return scale*gap[0]
+        gap += np.dot(model.delays(l), np.array(l).ravel()) - (beq.T*y)[0]
+    return scale*gap
+    
+
+
+def pareto_point(data, ls_obs, obs, degree, w_obs, w_gap, scale, max_iter=3, xs=None):
+    """Solve one point of the sweep of multi_objective_solver
+    
+    Parameters
+    ----------
+    data: Aeq, beqs, ffdelays, slopes from get_data(graphs)
+    w_obs, w_gap: scaled weights on the observation residual and the gap function
+    scale: scaling factors from compute_scaling
+    xs: warm starts for x_solver, e.g. from a neighbouring point
+    
+    Return value
+    ------------
+    theta, r_gap, r_obs, x_est: see multi_objective_solver
+    xs: solutions of x_solver, to warm start the neighbouring points
+    """
+    Aeq, beqs, ffdelays, slopes = data
+    N = len(beqs)
+    xs = [None]*N if xs is None else list(xs)
+    theta, ys, ls = solver_mis(data, ls_obs, obs, degree, w_obs, max_iter, True, w_gap, xs=xs)
+    coefs = compute_coefs(ffdelays, slopes, theta)
+    r_gap = compute_gap(ls, ys, matrix([[ffdelays], [coefs]]), beqs, scale[1])
+    r_obs = scale[0]*0.5*np.linalg.norm(matrix(ls_obs)-matrix([l[obs] for l in ls]), 2)**2
+    # the ue programs of x_est are warm started from the last x_solver solutions
+    x_est = matrix([ue.solver(data=(Aeq, beqs[k], ffdelays, coefs, 'Polynomial'), x0=xs[k]) for k in range(N)])
+    return theta, r_gap, r_obs, x_est, xs
+
+
+def pareto_task(args):
+    """Solve pareto_point in a worker of an XSolverPool, return (i, result, running time)"""
+    i, beqs, slopes, ls_obs, obs, degree, w_obs, w_gap, scale, max_iter, xs = args
+    start = time.time()
+    data = (worker['Aeq'], beqs, worker['ffdelays'], slopes)
+    result = pareto_point(data, ls_obs, obs, degree, w_obs, w_gap, scale, max_iter, xs)
+    return i, result, time.time() - start
+
+
+def sweep_order(ws, processes=1):
+    """Order the points of the sweep for the warm starts from the closest finished point
+    in sequence, the weights are sorted such that each point starts from the adjacent weight
+    in parallel, the first points submitted start cold so each weight is the farthest from
+    the previous ones: the extreme weights are solved first and each following point is close
+    to a point already started. The more processes, the fewer points are warm started
     
+    Parameters
+    ----------
+    ws: list of weights
+    processes: number of points solved in parallel
+    """
+    if processes <= 1: return [int(i) for i in np.argsort(ws)]
+    order = [int(np.argmin(ws))]
+    while len(order) < len(ws):
+        d = [-1.0 if i in order else min([abs(w-ws[j]) for j in order]) for i,w in enumerate(ws)]
+        order.append(int(np.argmax(d)))
+    return order
 
 
-def multi_objective_solver(graphs, ls_obs, obs, degree, w_multi, max_iter=3):
+def multi_objective_solver(graphs, ls_obs, obs, degree, w_multi, max_iter=3, processes=1, full=False, callback=None):
     """Multi-objective optimization for the latency inference problem with the following weights:
     w1: weight on the observation residual
     w2: weight on the gap function
     w1 + w2 = 1
     
+    The points of the sweep are solved in the order of sweep_order, in parallel if processes > 1,
+    and the x_solver problems of each point are warm started from the finished point
+    with the closest weight. With processes = len(w_multi), all the points start at once and
+    cold, each point still warm starts its later iterations from its own previous x_solver
+    solutions (see solver_mis) and the ue programs of x_est from its last ones
+    
     Parameters
     ----------
     graphs: list of graphs
@@ -337,21 +497,50 @@ def multi_objective_solver(graphs, ls_obs, obs, degree, w_multi, max_iter=3):
     degree: degree of the polynomial function to estimate
     w_multi: list of weights on the observation residual
     max_iter: maximum number of iterations
+    processes: if > 1, number of processes of the XSolverPool solving the points in parallel
+    full: if True, also return the running time of each point
+    callback: if given, callback(i, theta, r_gap, r_obs, x_est) is called as soon as
+    the point of weight w_multi[i] is finished
     """
     data = get_data(graphs)
-    scale = compute_scaling(graphs, ls_obs, obs, data)
-    w_obs = [scale[0]*w for w in w_multi] # weights on the observation residual
-    w_gap = [scale[1]*(1-w) for w in w_multi] # weights on the gap function
-    #softs = [(scale[0]*w)/(scale[1]*(1-w)) for w in w_multi]
     Aeq, beqs, ffdelays, slopes = data
-    type, N = 'Polynomial', len(beqs)
-    r_gap, r_obs, x_est, thetas = [], [], [], []
-    for w1,w2 in zip(w_obs,w_gap):
-        theta, ys, ls = solver_mis(data, ls_obs, obs, degree, 0.0*np.ones(degree), w1, max_iter, True, w2)
-        coefs = compute_coefs(ffdelays, slopes, theta)
-        r_gap.append(compute_gap(ls, ys, matrix([[ffdelays], [coefs]]), beqs, scale[1]))
-        r_obs.append(scale[0]*0.5*np.linalg.norm(matrix(ls_obs)-matrix([l[obs] for l in ls]), 2)**2)
-        xs = [ue.solver(data=(Aeq, beqs[k], ffdelays, coefs, type)) for k in range(N)]
-        x_est.append(matrix(xs))
-        thetas.append(theta)
+    K = len(w_multi)
+    results, times = [None]*K, [None]*K
+    pool = XSolverPool(Aeq, ffdelays, processes) if processes > 1 else None
+    try:
+        scale = compute_scaling(graphs, ls_obs, obs, data, pool)
+        w_obs = [scale[0]*w for w in w_multi] # weights on the observation residual
+        w_gap = [scale[1]*(1-w) for w in w_multi] # weights on the gap function
+        #softs = [(scale[0]*w)/(scale[1]*(1-w)) for w in w_multi]
+        
+        def warm_start(i):
+            done = [j for j in range(K) if results[j] is not None]
+            if len(done) == 0: return None
+            return results[min(done, key=lambda j: abs(w_multi[j]-w_multi[i]))][4]
+        
+        pending, running, start = sweep_order(w_multi, processes), [], time.time()
+        while pending or running:
+            if pool is None:
+                i = pending.pop(0)
+                t = time.time()
+                result = pareto_point(data, ls_obs, obs, degree, w_obs[i], w_gap[i], scale, max_iter, warm_start(i))
+                finished = [(i, result, time.time() - t)]
+            else:
+                while pending and len(running) < processes:
+                    i = pending.pop(0)
+                    args = (i, beqs, slopes, ls_obs, obs, degree, w_obs[i], w_gap[i], scale, max_iter, warm_start(i))
+                    running.append(pool.submit(pareto_task, args))
+                running[0].wait(0.1)
+                ready = [r.ready() for r in running]
+                finished = [r.get() for r,done in zip(running, ready) if done]
+                running = [r for r,done in zip(running, ready) if not done]
+            for i, result, t in finished:
+                results[i], times[i] = result, t
+                logging.info('Weight {}: {:.2f}s, {}/{} points in {:.2f}s'.format(
+                    w_multi[i], t, K-len(pending)-len(running), K, time.time()-start))
+                if callback is not None: callback(i, *result[:4])
+    finally:
+        if pool is not None: pool.close()
+    thetas, r_gap, r_obs, x_est = [[result[k] for result in results] for k in range(4)]
+    if full: return r_gap, r_obs, x_est, thetas, times
     return r_gap, r_obs, x_est, thetas
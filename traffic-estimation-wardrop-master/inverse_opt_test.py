@@ -11,6 +11,7 @@ from generate_graph import los_angeles
 import matplotlib.pyplot as plt
 from cvxopt import matrix
 from util import add_noise
+import time
 
 a, b = 3.5, 3.0
 coef = matrix([0.0, 0.0, 0.0, 0.15, 0.0, 0.0])
@@ -154,6 +155,62 @@ def test3(delaytype, noise):
         display_results(mean_error, true_theta, thetas, delaytype, dev_error)
 
 
+def count_iterations():
+    """Wrap ue.objective_poly to count its hessian evaluations,
+    i.e. the iterations of cvxopt.solvers.cp, return the counter and a function restoring it"""
+    objective, counter = ue.objective_poly, [0]
+    def counted(x, z, *args):
+        if z is not None: counter[0] += 1
+        return objective(x, z, *args)
+    ue.objective_poly = counted
+    def restore(): ue.objective_poly = objective
+    return counter, restore
+
+
+def test4(max_iter=3):
+    """Benchmark the warm starts of x_solver in invopt.solver_mis on los_angeles"""
+    graphs = los_angeles(coef, 'Polynomial')
+    ls = [ue.solver(g) for g in graphs]
+    data = invopt.get_data(graphs)
+    counter, restore = count_iterations()
+    try:
+        for warm in [False, True]:
+            counter[0], start = 0, time.clock()
+            theta = invopt.solver_mis(data, ls, range(graph.numlinks), degree, max_iter=max_iter, warm=warm)
+            print 'warm={}: {} iterations, {:.2f}s'.format(warm, counter[0], time.clock() - start)
+    finally: restore()
+
+
+def test5(days=100, noise=0.05):
+    """Calibrate the polynomial delay on los_angeles from days noisy observed days
+    with the sparse LP of invopt.solver"""
+    graphs = []
+    for i in range(days/4): graphs += los_angeles(coef, 'Polynomial', noise)
+    ls = [ue.solver(g) for g in graphs]
+    start = time.clock()
+    theta = invopt.solver(invopt.get_data(graphs), ls, degree)
+    print '{} days: {:.2f}s'.format(len(graphs), time.clock() - start)
+    print 'estimated theta:', theta.T
+
+
+def test6(processes=4, max_iter=3):
+    """Benchmark invopt.solver_mis on los_angeles with the observations solved
+    in sequence or in parallel by an XSolverPool"""
+    graphs = los_angeles(coef, 'Polynomial')
+    ls = [ue.solver(g) for g in graphs]
+    data = invopt.get_data(graphs)
+    obs = range(0, graph.numlinks, 2)
+    ls_obs = [l[obs] for l in ls]
+    start = time.time()
+    theta1 = invopt.solver_mis(data, ls_obs, obs, degree, max_iter=max_iter)
+    t1 = time.time() - start
+    start = time.time()
+    with invopt.XSolverPool(data[0], data[2], processes) as pool:
+        theta2 = invopt.solver_mis(data, ls_obs, obs, degree, max_iter=max_iter, pool=pool)
+    t2 = time.time() - start
+    print 'sequential {:.2f}s, {} processes {:.2f}s, max diff {:.1e}'.format(t1, processes, t2, max(abs(theta1-theta2)))
+
+
 def plot_errors():
     """Display errorbars from results of esperiments"""
     x = [100.0*i/60.0 for i in range(5)]
@@ -198,6 +255,9 @@ def main():
     test1(type, noise)
     #test2(type, noise)
     #test3(type, noise)
+    #test4()
+    #test5()
+    #test6()
     #plot_errors()
     
     
@@ -40,6 +40,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from cvxopt import matrix
 import random
+import time
 
 import Waypoints as WP
 import wp_generator as wp
@@ -124,19 +125,15 @@ def run_experiments_2(trials):
                 g, f, l, path_wps, wp_trajs, observations = synthetic_data(d, SO, demand, N)
                 norm_f = np.linalg.norm(f, 1)
                 ratio += len(wp_trajs)/ len(path_wps)
-                for i, obs in observations.items():
+                sets = [observations[i] for i in range(N)]
+                # experiments with od, cp and cp+od for all the sets of observed links
+                od = path.nested_pathflows(g, l, sets, with_ODs=True, x_true=f)
+                cp = path.nested_pathflows(g, l, sets, with_cell_paths=True, x_true=f, wp_trajs=wp_trajs)
+                od_cp = path.nested_pathflows(g, l, sets, with_ODs=True, with_cell_paths=True, x_true=f, wp_trajs=wp_trajs)
+                for i in range(N):
                     print 'observations', i
-                    # experiments with od
-                    x, rank, dim = path.feasible_pathflows(g, l[obs], obs, with_ODs=True, x_true=f)
-                    e_od, d_od = np.linalg.norm(f-x, 1) / norm_f, dim - rank
-                    # experiments with cp
-                    x, rank, dim = path.feasible_pathflows(g, l[obs], obs, 
-                        with_ODs=False, with_cell_paths=True, x_true=f, wp_trajs=wp_trajs)
-                    e_cp, d_cp = np.linalg.norm(f-x, 1) / norm_f, dim - rank
-                    # experiments with cp+od
-                    x, rank, dim = path.feasible_pathflows(g, l[obs], obs, 
-                        with_ODs=True, with_cell_paths=True, x_true=f, wp_trajs=wp_trajs)
-                    e_od_cp, d_od_cp = np.linalg.norm(f-x, 1) / norm_f, dim - rank
+                    (e_od, d_od), (e_cp, d_cp), (e_od_cp, d_od_cp) = [
+                        (np.linalg.norm(f-x, 1) / norm_f, dim - rank) for x, rank, dim in (od[i], cp[i], od_cp[i])]
                     # store data
                     err_od[i] += e_od; ddl_od[i] += d_od
                     err_od_cp[i] += e_od_cp; ddl_od_cp[i] += d_od_cp
@@ -164,6 +161,26 @@ def run_experiments_2(trials):
         out.write('%s' % ratio_so)
     
 
+def benchmark_feasible_pathflows(d=data[2], SO=False):
+    """Compare the projected gradient (method='pg') and the cvxopt.solvers.cp (method='cp')
+    engines of path.feasible_pathflows on the matrices of run_experiments_2"""
+    g, f, l, path_wps, wp_trajs, observations = synthetic_data(d, SO, demand, N)
+    norm_f = np.linalg.norm(f, 1)
+    P = linkpath_incidence(g)
+    configs = [('od', {'with_ODs': True}),
+               ('cp', {'with_cell_paths': True, 'wp_trajs': wp_trajs}),
+               ('od+cp', {'with_ODs': True, 'with_cell_paths': True, 'wp_trajs': wp_trajs})]
+    for i, obs in observations.items():
+        for name, kwargs in configs:
+            results = []
+            for method in ['pg', 'cp']:
+                start = time.time()
+                x = path.feasible_pathflows(g, l[obs], obs, method=method, **kwargs)[0]
+                results += [time.time() - start, np.linalg.norm(P[obs,:]*x - l[obs]), np.linalg.norm(f-x, 1) / norm_f]
+            print '{} links, {}: pg {:.3f}s res {:.1e} err {:.3f}, cp {:.3f}s res {:.1e} err {:.3f}'.format(
+                len(obs), name, *results)
+
+
 def experiment(data=None, SO=False, trials=5, demand=3, N=10, withODs=False, data_id=None):
     """Run set of experiments
     Steps:
@@ -207,45 +224,26 @@ def experiment(data=None, SO=False, trials=5, demand=3, N=10, withODs=False, dat
         err_f = lambda x: np.linalg.norm(f_true-x, 1) / norm_f
         err_l = lambda x: np.linalg.norm(l-x, 1) / norm_l
         P = path.linkpath_incidence(g)
-        ls, fs = [], []
-        #print 'Compute min ||P*f-l|| s.t. U*f=r, x>=0 with U=OD-path incidence matrix'
         # A trial must complete successfully for all 2*N tests for it to count
-        failed = False
-        for i in range(N):
-            try:
-                f, rank, dim = path.feasible_pathflows(g, l[obs[i]], obs[i], with_ODs=True, x_true=f_true)
-                ddl_ODs[i].append(dim - rank)
-            except (ValueError, UnboundLocalError) as e:
-                print e
-                # 'Probably your QP is either non-positively defined (for cvxopt_qp you should have xHx > 0 for any x != 0) or very ill-conditioned.'           # __str__ allows args to be printed directly
-                failed = True
-                break
-            fs.append(f)
-            ls.append(P*f)
-        #print 'Compute min ||P*f-l|| s.t. U*f=r, x>=0 with U=waypoint-path incidence matrix'
-        if failed:
+        sets = [obs[i] for i in range(N)]
+        try:
+            #print 'Compute min ||P*f-l|| s.t. U*f=r, x>=0 with U=OD-path incidence matrix'
+            results = path.nested_pathflows(g, l, sets, with_ODs=True, x_true=f_true)
+            #print 'Compute min ||P*f-l|| s.t. U*f=r, x>=0 with U=waypoint-path incidence matrix'
+            results += path.nested_pathflows(g, l, sets, with_ODs=withODs, with_cell_paths=True,
+                                             x_true=f_true, wp_trajs=wp_trajs)
+        except (ValueError, UnboundLocalError) as e:
+            print e
+            # 'Probably your QP is either non-positively defined (for cvxopt_qp you should have xHx > 0 for any x != 0) or very ill-conditioned.'           # __str__ allows args to be printed directly
             continue
+        fs = [f for f, rank, dim in results]
+        ls = [P*f for f in fs]
         for i in range(N):
-            try:
-                f, rank, dim = path.feasible_pathflows(g, l[obs[i]], obs[i], 
-                    with_ODs=withODs, with_cell_paths=True, x_true=f_true, wp_trajs=wp_trajs)
-                ddl_cellpaths[i].append(dim - rank)
-                if data[0] + data[1] + data[3][0][1] == 40:
-                    string = '+OD' if withODs else ''
-                    print 'rank={}, num_obs={}, cellpath'.format(rank, len(obs[i])) + string 
-                # Throw out trials for which any domain error is caught
-                #for j in range(U.size[0]):
-                #    path.feasible_pathflows(g, l[obs[i]], obs[i], eq_constraints=(U[:j,:],r[:j]))
-            except (ValueError, UnboundLocalError) as e:
-                print e
-                # 'Probably your QP is either non-positively defined (for cvxopt_qp you should have xHx > 0 for any x != 0) or very ill-conditioned.'           # __str__ allows args to be printed directly
-                failed = True
-                break
-            fs.append(f)
-            ls.append(P*f)
-
-        if failed:
-            continue
+            ddl_ODs[i].append(results[i][2] - results[i][1])
+            ddl_cellpaths[i].append(results[N+i][2] - results[N+i][1])
+            if data[0] + data[1] + data[3][0][1] == 40:
+                string = '+OD' if withODs else ''
+                print 'rank={}, num_obs={}, cellpath'.format(results[N+i][1], len(obs[i])) + string
         k += 1
         l_error = [err_l(ls[i]) for i in range(numexp)]
         f_error = [err_f(fs[i]) for i in range(numexp)]
@@ -469,6 +467,7 @@ def main():
     run_experiments_2(trials=trials)
     display_results_2()
     #run_QP_ranks(False)
+    #benchmark_feasible_pathflows()
     #display_ranks()
     #display_ratios()
 
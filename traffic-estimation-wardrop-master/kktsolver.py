@@ -20,27 +20,41 @@ along with CVXPY.  If not, see <http://www.gnu.org/licenses/>.
 # A custom KKT solver for CVXOPT that can handle redundant constraints.
 # Uses regularization and iterative refinement.
 
-from cvxopt import blas, lapack
-from cvxopt.base import matrix
+from cvxopt import blas, lapack, umfpack, cholmod
+from cvxopt.base import matrix, spmatrix, sparse, spdiag, mul
 from cvxopt.misc import scale, pack, unpack
+import numpy as np
 
 # Regularization constant.
 REG_EPS = 1e-9
+# Number of iterative refinement steps of the sparse solver.
+REFINE = 2
+# 'sparse': if True, use kkt_sparse when the problem allows it.
+options = {'sparse': True}
 
 # Returns a kktsolver for linear cone programs (or nonlinear if F is given).
-def get_kktsolver(G, dims, A, F=None):
+# If blocks is given, the hessian returned by F is [[diag(h)]*blocks]*blocks,
+# i.e. the hessian of a separable function of l = sum_w x_w (see kkt_sparse).
+def get_kktsolver(G, dims, A, F=None, blocks=None):
+    mnl = 0 if F is None else F()[0]
+    if options['sparse'] and sparse_applicable(dims, mnl):
+        factor = kkt_sparse(G, dims, A, mnl, blocks)
+    else:
+        factor = kkt_ldl(G, dims, A, mnl)
     if F is None:
-        factor = kkt_ldl(G, dims, A)
         def kktsolver(W):
             return factor(W)
     else:
-        mnl, x0 = F()
-        factor = kkt_ldl(G, dims, A, mnl)
         def kktsolver(x, z, W):
             f, Df, H = F(x, z)
             return factor(W, H, Df)
     return kktsolver
 
+def sparse_applicable(dims, mnl):
+    """kkt_sparse handles linear inequalities (no second-order or semidefinite cones)
+    and no nonlinear inequality constraints"""
+    return mnl == 0 and len(dims['q']) == 0 and len(dims['s']) == 0
+
 def kkt_ldl(G, dims, A, mnl = 0):
     """
     Solution of KKT equations by a dense LDL factorization of the
@@ -109,4 +123,207 @@ def kkt_ldl(G, dims, A, mnl = 0):
 
         return solve
 
-    return factor
\ No newline at end of file
+    return factor
+
+def kkt_sparse(G, dims, A, mnl = 0, blocks = None):
+    """
+    Solution of KKT equations by a sparse LU factorization of the
+    reduced system, for problems with only linear inequalities.
+
+    With W = diag(d) and z eliminated, returns a function that (1) computes
+    the sparse factorization of
+
+        [ H + G'*W^{-2}*G + eps*I   A'     ]
+        [ A                         -eps*I ],
+
+    given H and W, and (2) returns a function for solving
+
+        [ H     A'   G'    ]   [ ux ]   [ bx ]
+        [ A     0    0     ] * [ uy ] = [ by ].
+        [ G     0   -W'*W  ]   [ uz ]   [ bz ]
+
+    If blocks is given, H = S'*diag(h)*S with S = [I, ..., I] the sum over
+    the blocks of x. The dense p x p coupling of the blocks is then kept out
+    of the factorization by factoring instead
+
+        [ G'*W^{-2}*G + eps*I   A'       S' ]
+        [ A                     -eps*I   0  ]
+        [ diag(h)*S             0       -I  ]
+
+    with the extra variable w = diag(h)*S*ux.
+
+    The regularization eps is compensated by iterative refinement on the
+    unregularized system. The symbolic factorization is reused as long as
+    the sparsity pattern does not change. If the numeric factorization
+    fails, falls back on kkt_ldl for this iteration.
+    """
+
+    p, n = A.size
+    G, A = sparse(G), sparse(A)
+    q = 0 if blocks is None else n/blocks
+    reg = spdiag(matrix([REG_EPS]*n + [-REG_EPS]*p + [0.0]*q))
+    if blocks is not None:
+        I, J = [i % q for i in range(n)], range(n)
+        S = spmatrix(1.0, I, J, (q,n))
+    symbolic = {'pattern': None, 'F': None}
+    dense = {}
+
+    def factor(W, H = None, Df = None):
+        di = W['di']
+        D = spdiag(di**2)
+        K0 = G.T * D * G
+        if blocks is None:
+            if H is not None: K0 = K0 + sparse(H)
+            K0 = sparse([[K0, A], [A.T, spmatrix([], [], [], (p,p))]])
+        else:
+            h = np.zeros(q)
+            if H is not None:
+                H = sparse(H)
+                i, j = np.array(H.I).ravel(), np.array(H.J).ravel()
+                diag = (i == j) & (i < q)
+                h[i[diag]] = np.array(H.V).ravel()[diag]
+            K0 = sparse([[K0, A, spmatrix(h[I], I, J, (q,n))],
+                         [A.T, spmatrix([], [], [], (p,p)), spmatrix([], [], [], (q,p))],
+                         [S.T, spmatrix([], [], [], (p,q)), spdiag(matrix(-1.0, (q,1)))]])
+        K = K0 + reg
+        pattern = (list(K.CCS[0]), list(K.CCS[1]))
+        if pattern != symbolic['pattern']:
+            symbolic['pattern'], symbolic['F'] = pattern, umfpack.symbolic(K)
+        try:
+            numeric = umfpack.numeric(K, symbolic['F'])
+        except ArithmeticError:
+            if 'factor' not in dense: dense['factor'] = kkt_ldl(G, dims, A, mnl)
+            return dense['factor'](W, H, Df)
+
+        def solve(x, y, z):
+
+            # Solve
+            #
+            #     [ H + G'*W^{-2}*G   A' ]   [ ux ]   [ bx + G'*W^{-2}*bz ]
+            #     [ A                 0  ] * [ uy ] = [ by                ]
+            #
+            # and W*uz = W^{-1}*(G*ux - bz).
+            #
+            # On entry, x, y, z contain bx, by, bz.  On exit, they contain
+            # the solution ux, uy, W*uz.
+            rhs = matrix([x + G.T * (D * z), y, matrix(0.0, (q,1))])
+            u = +rhs
+            umfpack.solve(K, numeric, u)
+            for k in range(REFINE):
+                r = rhs - K0 * u
+                umfpack.solve(K, numeric, r)
+                u += r
+            blas.copy(u, x, n = n)
+            blas.copy(u, y, offsetx = n, n = p)
+            z[:] = mul(di, G * x - z)
+
+        return solve
+
+    return factor
+
+def kkt_blocks(G, dims, k, blocks):
+    """
+    Solution of KKT equations of a linear program without equality
+    constraints whose variables are t = x[:k], coupling all the constraints,
+    and independent blocks of variables. Up to a permutation of its rows,
+
+        G = [ B_1   G_1               ]
+            [ B_2         G_2         ]
+            [ ...               ...   ]
+            [ B_0                     ]
+
+    where the rows and columns of G_j are given by blocks[j] = (rows, cols).
+
+    With W = diag(d), returns a function that (1) factors each
+    K_j = G_j'*W_j^{-2}*G_j with cholmod and the dense k x k Schur complement
+
+        S = B_0'*W_0^{-2}*B_0 + sum_j B_j'*W_j^{-2}*B_j - H_j'*K_j^{-1}*H_j
+
+    with H_j = G_j'*W_j^{-2}*B_j,
+    given W, and (2) returns a function for solving
+
+        [ 0     G'    ]   [ ux ]   [ bx ]
+        [ G    -W'*W  ] * [ uz ] = [ bz ].
+
+    The K_j and S are regularized by eps*I, which is compensated by iterative
+    refinement on G'*W^{-2}*G. Only the factors of the K_j and the sparse H_j
+    are kept, K_j^{-1}*H_j is formed block by block for S and the solves use
+    two solves with the factor of each K_j, so the memory is linear in the
+    number of blocks. If a K_j is not
+    positive definite, falls back on kkt_sparse for this iteration.
+    """
+
+    G = sparse(G)
+    N, n = G.size
+    used = np.zeros(N, dtype=bool)
+    parts = []
+    for rows, cols in blocks:
+        rows, cols = list(rows), list(cols)
+        used[rows] = True
+        parts.append((rows, cols, G[rows, :k], G[rows, cols]))
+    rows0 = np.where(~used)[0].tolist()
+    G0 = G[rows0, :k] if rows0 else spmatrix([], [], [], (0,k))
+    symbolic = [None]*len(parts)
+    fallback = {}
+    regs = [spdiag(matrix(REG_EPS, (len(cols),1))) for rows, cols, B, Gj in parts]
+
+    def factor(W):
+        di = W['di']
+        d2 = di**2
+        S = matrix(spdiag(matrix(REG_EPS, (k,1))))
+        if rows0: S += matrix(G0.T * spdiag(d2[rows0]) * G0)
+        Hs = []
+        try:
+            for j, (rows, cols, B, Gj) in enumerate(parts):
+                D = spdiag(d2[rows])
+                K = Gj.T * D * Gj + regs[j]
+                if symbolic[j] is None: symbolic[j] = cholmod.symbolic(K)
+                cholmod.numeric(K, symbolic[j])
+                H = Gj.T * D * B
+                V = matrix(H)
+                cholmod.solve(symbolic[j], V)
+                S += matrix(B.T * D * B) - H.T * V
+                Hs.append(H)
+            lapack.potrf(S)
+        except ArithmeticError:
+            if 'factor' not in fallback:
+                fallback['factor'] = kkt_sparse(G, dims, spmatrix([], [], [], (0,n)))
+            return fallback['factor'](W)
+
+        def reduced_solve(r):
+            # solve the regularized G'*W^{-2}*G * u = r by block elimination
+            u, t = matrix(0.0, (n,1)), r[:k]
+            for (rows, cols, B, Gj), H, F in zip(parts, Hs, symbolic):
+                v = r[cols]
+                cholmod.solve(F, v)
+                t -= H.T * v
+            lapack.potrs(S, t)
+            u[:k] = t
+            for (rows, cols, B, Gj), H, F in zip(parts, Hs, symbolic):
+                v = r[cols] - H * t
+                cholmod.solve(F, v)
+                u[cols] = v
+            return u
+
+        def solve(x, y, z):
+
+            # Solve
+            #
+            #     G'*W^{-2}*G * ux = bx + G'*W^{-2}*bz
+            #
+            # by block elimination of the u_j = ux[cols_j], with iterative
+            # refinement on the unregularized system, and
+            # W*uz = W^{-1}*(G*ux - bz).
+            #
+            # On entry, x, z contain bx, bz.  On exit, they contain
+            # the solution ux, W*uz.
+            r = x + G.T * mul(d2, z)
+            u = reduced_solve(r)
+            for i in range(REFINE):
+                u += reduced_solve(r - G.T * mul(d2, G * u))
+            blas.copy(u, x)
+            z[:] = mul(di, G * x - z)
+
+        return solve
+
+    return factor
@@ -6,9 +6,12 @@ Created on Jul 23, 2014
 
 REG_EPS = 1e-9
 TOL = 1e-5
+SHORTEST = 0.9 # fraction of the OD flows on the shortest paths in solver_init(delays=...)
+MAX_RETRIES = 2 # maximum number of restarts of solver when the gap is above TOL
+PERTURB = 0.1 # weight of the initial point in the restarts of solver
 
 import ue_solver as ue
-from cvxopt import matrix, spmatrix, spdiag, solvers, div
+from cvxopt import matrix, spmatrix, spdiag, solvers, div, sparse
 import numpy.random as ra
 import numpy as np
 import logging
@@ -20,68 +23,90 @@ import Waypoints as WP
 import rank_nullspace as rn
 from util import find_basis
 from kktsolver import get_kktsolver
+import fw_solver as fw
+from shortest_paths import shortest_path_tree
 
 
 
 def linkpath_incidence(graph):
     """Returns matrix of incidence link-path
+    it is built once from the paths of graph.get_arrays() and shared, do not modify it
     """
-    I, J, entries = [], [], []
-    for id1,link in graph.links.items():
-        if len(link.paths) > 0:
-            for id2 in link.paths.keys():
-                I.append(graph.indlinks[id1])
-                J.append(graph.indpaths[id2])
-                entries.append(1.0)
-        else:
-            I.append(graph.indlinks[id1])
-            J.append(0)
-            entries.append(0.0)
-    return spmatrix(entries, I, J)
+    return graph.get_arrays().linkpath
 
 
 def path_to_OD_simplex(graph):
     """Construct constraints for feasible path flows
+    U is built once from the paths of graph.get_arrays() and shared, do not modify it
     
     Return value
     ------------
     U: matrix of simplex constraints
     r: matrix of OD flows
     """
-    I, J, r = [], [], matrix(0.0, (graph.numODs,1))
-    for id1,od in graph.ODs.items():
-        r[graph.indods[id1]] = od.flow
-        for id2,path in od.paths.items():
-            I.append(graph.indods[id1])
-            J.append(graph.indpaths[id2])
-    return spmatrix(1.0, I, J), r
+    arrays = graph.get_arrays()
+    return arrays.odpath, matrix(arrays.demands)
 
 
-def solver_init(U,r, random=False):
+def solver_init(U,r, random=False, delays=None):
     """Initialize with a feasible point
+    the flow r[i] of each OD i is split among its paths, the columns j with U[i,j] = 1,
+    from the row index of the entries of U, in a single pass over them
     
     Parameters:
     ---------
     U: matrix of simplex constraints
     r: matrix of OD flows
-    random: if true
+    random: if true, split with random weights from a flat Dirichlet distribution, else uniformly
+    delays: if given, delays of the paths, SHORTEST of the flow of each OD is put
+    on its path of minimum delay and the rest is split among all its paths
     """
     n,m = U.size
-    x0 = matrix(0.0, (m,1))
-    for i in range(n):
-        k = int(sum(U[i,:]))
-        if random:
-            tmp = ra.rand(k)
-            tmp = r[i]*(tmp/sum(tmp))
-        else: tmp = [r[i]/k]*k
-        k = 0
-        for j in range(m):
-            if U[i,j] > 0.0: x0[j] = tmp[k]; k += 1
-    return x0
-
-
-def solver(graph, update=False, data=None, SO=False, random=False):
+    I, J = np.array(U.I, dtype=int).ravel(), np.array(U.J, dtype=int).ravel()
+    r = np.array(r, dtype=float).ravel()
+    weights = ra.exponential(size=len(J)) if random else np.ones(len(J))
+    weights /= np.bincount(I, weights, minlength=n)[I]
+    if delays is not None:
+        d = np.array(delays, dtype=float).ravel()[J]
+        order = np.lexsort((d, I))
+        first = order[np.r_[True, I[order][1:] != I[order][:-1]]] # path of minimum delay of each OD
+        weights *= 1.0-SHORTEST
+        weights[first] += SHORTEST
+    x0 = np.zeros(m)
+    np.add.at(x0, J, r[I]*weights)
+    return matrix(x0)
+
+
+def path_gap(x, c, U):
+    """Relative gap of the path flows x for the path costs c
+    (sum_j x_j*c_j - sum_i r_i*min_{j in OD i} c_j) / sum_j x_j*c_j with r_i the flow of OD i,
+    it is zero iff only paths of minimum cost are used, i.e. x is an equilibrium on its paths
+    
+    Parameters
+    ----------
+    x: path flows
+    c: path costs, delays for UE and marginal delays for SO
+    U: matrix of simplex constraints
+    """
+    n = U.size[0]
+    I, J = np.array(U.I, dtype=int).ravel(), np.array(U.J, dtype=int).ravel()
+    x, c = np.array(x).ravel(), np.array(c).ravel()
+    cmin = np.empty(n); cmin.fill(np.inf)
+    np.minimum.at(cmin, I, c[J])
+    r = np.bincount(I, x[J], minlength=n)
+    used = r > 0.0
+    total = np.dot(x, c)
+    return (total - np.dot(r[used], cmin[used])) / total
+
+
+def solver(graph, update=False, data=None, SO=False, random=False, shortest=False, check=False,
+           full=False):
     """Solve for the UE equilibrium using link-path formulation
+    the path flows are certified by the status of solvers.cp, their nonnegativity up to feastol
+    times the largest OD flow (they are then clipped to zero) and their relative gap (see path_gap),
+    if one of them fails the solve is restarted at most MAX_RETRIES times with tighter tolerances
+    from a strictly feasible point: the path flows projected on the OD simplices moved towards
+    the initial point
     
     Parameters
     ----------
@@ -92,6 +117,16 @@ def solver(graph, update=False, data=None, SO=False, random=False):
             U,r: simplex constraints 
     SO: if True compute SO
     random: if True, initialize with a random feasible point
+    shortest: if True, initialize with most of the OD flows on the free flow shortest paths
+    check: if True, also compute the link flows with ue.solver and log their distance to P*x
+    full: if True, also return the gap and the status of the last solve, else raise
+    ValueError if the path flows are not certified after MAX_RETRIES restarts
+    
+    Return value
+    ------------
+    x: path flows
+    l: link flows P*x, or from ue.solver if check
+    gap, status: if full, relative gap of x and status of solvers.cp
     """
     type = graph.links.values()[0].delayfunc.type
     if data is None:
@@ -101,6 +136,7 @@ def solver(graph, update=False, data=None, SO=False, random=False):
     m = graph.numpaths
     A, b = spmatrix(-1.0, range(m), range(m)), matrix(0.0, (m,1))
     ffdelays = graph.get_ffdelays()
+    delays = P.T*ffdelays if shortest else None
     if type == 'Polynomial':
         coefs = graph.get_coefs()
         if not SO: coefs = coefs * spdiag([1.0/(j+2) for j in range(coefs.size[1])])
@@ -109,49 +145,252 @@ def solver(graph, update=False, data=None, SO=False, random=False):
     if type == 'Hyperbolic':
         ks = graph.get_ks()
         parameters = matrix([[ffdelays-div(ks[:,0],ks[:,1])], [ks]])
-        G = ue.objective_hyper
+        G = ue.objective_hyper_SO if SO else ue.objective_hyper
+    x0 = solver_init(U,r,random,delays)
+    start = [x0]
     def F(x=None, z=None):
-        if x is None: return 0, solver_init(U,r,random)
+        if x is None: return 0, start[0]
         if z is None:
             f, Df = G(P*x, z, parameters, 1)
             return f, Df*P
         f, Df, H = G(P*x, z, parameters, 1)
         return f, Df*P, P.T*H*P    
-    failed = True
-    while failed:
-        x = solvers.cp(F, G=A, h=b, A=U, b=r)['x']
+    options = dict(solvers.options)
+    groups = simplex_groups(U)
+    # the flows of the unused paths come back as small negative numbers within the feasibility tolerance
+    negtol = options.get('feastol', 1e-7) * max(r)
+    for k in range(MAX_RETRIES+1):
+        sol = solvers.cp(F, G=A, h=b, A=U, b=r, options=options)
+        x, status = sol['x'], sol['status']
+        failed = [] if status == 'optimal' else ['status={}'.format(status)]
+        if min(x) < -negtol: failed.append('min path flow={} < {}'.format(min(x), -negtol))
+        x = matrix(np.maximum(np.array(x), 0.0))
+        gap = path_gap(x, F(x)[1].T, U)
+        if gap > TOL: failed.append('gap={} > {}'.format(gap, TOL))
+        if not failed: break
+        logging.warning('{}, refine path flows'.format(', '.join(failed)))
+        # restart from a strictly feasible point: x projected on the simplices moved towards x0 > 0
+        if groups is None: start[0] = x0
+        else:
+            y = simplex_projection(np.array(x).ravel(), groups, np.array(r).ravel())
+            start[0] = (1.0-PERTURB)*matrix(y) + PERTURB*x0
+        for key,tol in [('abstol', 1e-7), ('reltol', 1e-6), ('feastol', 1e-7)]:
+            options[key] = 1e-2*options.get(key, tol)
+    else:
+        if not full: raise ValueError('path flows not certified: {}'.format(', '.join(failed)))
+        logging.error('path flows not certified: {}'.format(', '.join(failed)))
+    l = P*x
+    if check:
         l = ue.solver(graph, SO=SO)
-        error = np.linalg.norm(P * x - l,1) / np.linalg.norm(l,1)
-        if error > TOL:
-            print 'error={} > {}, re-compute path_flow'.format(error, TOL)
-        else: failed = False
+        logging.info('distance to the node-link flows: {}'.format(np.linalg.norm(P*x - l,1) / np.linalg.norm(l,1)))
     if update:
         logging.info('Update link flows, delays in Graph.'); graph.update_linkflows_linkdelays(P*x)
         logging.info('Update path delays in Graph.'); graph.update_pathdelays()
         logging.info('Update path flows in Graph object.'); graph.update_pathflows(x)
-    # assert if x is a valid UE/SO
+    if full: return x, l, gap, status
     return x, l
 
 
-def feasible_pathflows(graph, l_obs, obs=None, update=False,
-                       with_cell_paths=False, with_ODs=False, x_true=None, wp_trajs=None):
-    """Attempts to find feasible pathflows given partial of full linkflows
+def shift_flows(routes, l, c, dc, update):
+    """Shift flow from the paths of an OD pair to its path of min cost with a Newton step
     
-    Parameters:
+    Parameters
     ----------
-    graph: Graph object
-    l_obs: observations of link flows
-    obs: indices of the observed links
-    update: if True, update path flows in graph
-    with_cell_paths: if True, include cell paths as constraints
-    with_ODs: if True, include ODs in the constraints if no with_cell_paths or in the objective if with_cell_paths
+    routes: list of (path, indices of the links of the path) of the OD pair
+    l: link flows
+    c, dc: link costs and their derivatives at l
+    update: update(ind) updates c[ind], dc[ind] after a change of l[ind]
+    """
+    s, ind_s = min(routes, key=lambda route: c[route[1]].sum())
+    for path,ind in routes:
+        if path is s or path.flow == 0.0: continue
+        ind_p, ind_q = np.setdiff1d(ind, ind_s), np.setdiff1d(ind_s, ind)
+        dcost, h = c[ind_p].sum() - c[ind_q].sum(), dc[ind_p].sum() + dc[ind_q].sum()
+        if dcost <= 0.0: continue
+        dx = path.flow if h <= 0.0 else min(path.flow, dcost/h)
+        path.flow -= dx; s.flow += dx
+        l[ind_p] -= dx; l[ind_q] += dx
+        update(np.concatenate((ind_p, ind_q)))
+
+
+def gradient_projection(graph, update=False, SO=False, max_iter=100, rgap=1e-6, sweeps=5, full=False):
+    """Solve for the UE path flows with path-based gradient projection (Jayakrishnan et al., 1994)
+    the route set is grown by column generation from the shortest paths at the current delays
+    and Path.flow is updated after each flow shift
+    
+    Parameters
+    ----------
+    graph: graph object, its paths and their flows are used as initial route set
+    (the demand of an OD pair whose path flows do not sum to its flow is put on its shortest path)
+    update: if True, update link flows, link and path delays in graph
+    SO: if True compute SO
+    max_iter: maximum number of iterations
+    rgap: stop when the relative gap c'(l-y)/c'l is below rgap,
+    where c are the (marginal) delays at l and y the all-or-nothing flows
+    sweeps: number of extra sweeps of flow shifts over the route set per iteration
+    full: if True, also return the relative gaps of the iterations
+    
+    Return value
+    ------------
+    x: path flows indexed by graph.indpaths
+    l: link flows
+    """
+    arrays = graph.get_arrays()
+    type = arrays.delaytype
+    if type not in ['Polynomial', 'Hyperbolic']:
+        logging.error('Delay functions must be all polynomial or all hyperbolic'); return
+    ks, groups, endnodes = fw.get_ks(arrays, SO), fw.destinations(arrays), arrays.endnodes.tolist()
+    l, routes, pending = np.zeros(graph.numlinks), {}, []
+    for id,od in graph.ODs.items():
+        routes[id] = [(path, np.array([graph.indlinks[link.repr()] for link in path.links], dtype=int))
+                      for path in od.paths.values()]
+        if abs(sum([path.flow for path in od.paths.values()]) - od.flow) > TOL*od.flow:
+            for path in od.paths.values(): path.flow = 0.0
+            pending.append(id)
+        for path,ind in routes[id]: l[ind] += path.flow
+    
+    def update_costs(ind): f, c[ind], dc[ind] = fw.evaluate(ks[ind], type, l[ind], SO)
+    
+    gaps = []
+    for it in range(max_iter):
+        f, c, dc = fw.evaluate(ks, type, l, SO)
+        shortest, spt = {}, 0.0
+        for sink, origins, demands in groups:
+            dist, next, order = shortest_path_tree(arrays, c, sink, origins)
+            for o,d in zip(origins, demands):
+                u, ind = o, []
+                while u != sink:
+                    if next[u] < 0:
+                        logging.error('Node {} cannot reach node {}'.format(o+1, sink+1)); return
+                    ind.append(next[u]); u = endnodes[next[u]]
+                spt += d*dist[o]
+                id = (o+1, sink+1)
+                for k,(path,ind2) in enumerate(routes[id]):
+                    if np.array_equal(ind, ind2): shortest[id] = k; break
+                else:
+                    graph.add_path([arrays.link_ids[i] for i in ind])
+                    routes[id].append((graph.paths[id + (graph.ODs[id].numpaths,)], np.array(ind, dtype=int)))
+                    shortest[id] = len(routes[id])-1
+        for id in pending:
+            path, ind = routes[id][shortest[id]]
+            path.flow = graph.ODs[id].flow
+            l[ind] += path.flow
+        if len(pending) > 0: pending = []; continue
+        gaps.append(1.0 - spt/np.dot(c, l))
+        logging.info('Gradient projection iteration {}: relative gap {}'.format(it, gaps[-1]))
+        if gaps[-1] < rgap: break
+        for i in range(sweeps+1):
+            for r in routes.values(): shift_flows(r, l, c, dc, update_costs)
+    x = matrix(0.0, (graph.numpaths,1))
+    for id,path in graph.paths.items(): x[graph.indpaths[id]] = path.flow
+    l = matrix(l)
+    if update:
+        logging.info('Update link flows, delays in Graph.'); graph.update_linkflows_linkdelays(l)
+        logging.info('Update path delays in Graph.'); graph.update_pathdelays()
+    if full: return x, l, gaps
+    return x, l
+
+
+def simplex_groups(U):
+    """Row of the entry of each column of U if U is a block simplex matrix, i.e. its entries
+    are ones and each column has at most one entry, -1 for the empty columns, else None"""
+    I, J, V = [np.array(v).ravel() for v in (U.I, U.J, U.V)]
+    if np.any(V != 1.0) or len(np.unique(J)) < len(J): return None
+    groups = -np.ones(U.size[1], dtype=int)
+    groups[J.astype(int)] = I
+    return groups
+
+
+def simplex_projection(y, groups, r):
+    """Euclidean projection of y onto {x >= 0, sum_{j: groups[j] == i} x_j = r[i] for all i}
+    by sorting y in each simplex, all the simplices at once, the columns j with groups[j] == -1
+    are projected onto x_j >= 0
+    
+    Parameters
+    ----------
+    y: numpy array
+    groups: numpy array of the simplex of each column, see simplex_groups
+    r: numpy array of the sums of the simplices
+    """
+    x = np.maximum(y, 0.0)
+    ind = np.flatnonzero(groups >= 0)
+    if len(ind) == 0: return x
+    ind = ind[np.lexsort((-y[ind], groups[ind]))]
+    g, ys = groups[ind], y[ind]
+    starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+    sizes = np.diff(np.r_[starts, len(g)])
+    cs = np.cumsum(ys)
+    cs -= np.repeat(cs[starts] - ys[starts], sizes) # cumulative sums within each simplex
+    k = np.arange(1, len(g)+1) - np.repeat(starts, sizes)
+    rho = np.maximum(np.add.reduceat((ys - (cs - r[g])/k > 0.0).astype(int), starts), 1)
+    tau = (cs[starts + rho - 1] - r[g[starts]]) / rho
+    x[ind] = np.maximum(ys - np.repeat(tau, sizes), 0.0)
+    return x
+
+
+def simplex_lsq(A, b, groups, r, x0=None, tol=1e-8, max_iter=10000):
+    """Solves min 0.5*||A*x-b||^2 s.t. U*x = r, x >= 0 for a block simplex matrix U
+    by accelerated projected gradient (FISTA) with a backtracking line search on the
+    Lipschitz constant and a restart of the momentum when the objective increases
+    
+    Parameters
+    ----------
+    A: sparse matrix
+    b: matrix of observations
+    groups: simplex of each column of U, see simplex_groups
+    r: matrix of the right hand side of U*x = r
+    x0: if given, initial point, else r split uniformly in each simplex
+    tol: stop when the gradient mapping is below tol*max(1,||A'*b||_inf)
+    max_iter: maximum number of iterations
+    """
+    A = rn.to_csc(A).tocsr()
+    AT = A.T.tocsr()
+    b, r = np.array(b, dtype=float).ravel(), np.array(r, dtype=float).ravel()
+    def project(y): return simplex_projection(y, groups, r)
+    x = project(np.zeros(A.shape[1]) if x0 is None else np.array(x0, dtype=float).ravel())
+    # estimate of ||A||^2 by power iterations, corrected by the line search
+    v, L = np.ones(A.shape[1]) / np.sqrt(max(A.shape[1], 1)), 0.0
+    for k in range(20):
+        v = AT.dot(A.dot(v))
+        L = np.linalg.norm(v)
+        if L == 0.0: break
+        v /= L
+    L = max(L, 1e-12)
+    scale = tol * max(1.0, np.abs(AT.dot(b)).max())
+    Ax = A.dot(x)
+    f = 0.5*np.dot(Ax-b, Ax-b)
+    y, Ay, t = x, Ax, 1.0
+    for k in range(max_iter):
+        grad = AT.dot(Ay-b)
+        fy = 0.5*np.dot(Ay-b, Ay-b)
+        while True:
+            x_new = project(y - grad/L)
+            Ax_new = A.dot(x_new)
+            d = x_new - y
+            f_new = 0.5*np.dot(Ax_new-b, Ax_new-b)
+            if f_new <= fy + np.dot(grad, d) + 0.5*L*np.dot(d, d) + 1e-12*fy: break
+            L *= 2.0
+        if L*np.abs(d).max() <= scale: x = x_new; break
+        if f_new > f: t_new, beta = 1.0, 0.0 # restart
+        else:
+            t_new = 0.5*(1.0 + np.sqrt(1.0 + 4.0*t*t))
+            beta = (t-1.0)/t_new
+        y, Ay = x_new + beta*(x_new-x), Ax_new + beta*(Ax_new-Ax)
+        x, Ax, f, t = x_new, Ax_new, f_new, t_new
+    return matrix(x)
+
+
+def pathflow_constraints(graph, with_cell_paths=False, with_ODs=False, wp_trajs=None):
+    """Matrices of feasible_pathflows that do not depend on the observed links
+    
+    Return value
+    ------------
+    P: link-path incidence matrix
+    Aeq, beq: route to OD flow or cellpath flow constraints
+    T, d: route to OD flow constraints included in the objective, None if not with_cell_paths and with_ODs
     """
     assert with_cell_paths or with_ODs # we must have some measurements!
-    n = graph.numpaths
-    # route to links flow constraints
-    A, b = linkpath_incidence(graph), l_obs
-    if obs: A = A[obs,:] # trim matrix if we have partial observations
-    Aineq, bineq = spmatrix(-1.0, range(n), range(n)), matrix(0.0, (n,1)) # positive constraints
+    P, T, d = linkpath_incidence(graph), None, None
     if not with_cell_paths: # if just with ODs flow measurements:
         Aeq, beq = path_to_OD_simplex(graph) # route to OD flow constraints
     else: # if we have cellpath flow measurements:
@@ -159,13 +398,23 @@ def feasible_pathflows(graph, l_obs, obs=None, update=False,
         Aeq, beq = WP.simplex(graph, wp_trajs) # route to cellpath flow constraints
         if with_ODs: # if we have ODs + cellpaths measurements
           T, d = path_to_OD_simplex(graph) # route to OD flow constraints included in objective
-          A, b = matrix([A, T]), matrix([b, d]) # add the constraints to the objective
-        
-    if x_true is not None:
-        err1 =  np.linalg.norm(A * x_true - b, 1) / np.linalg.norm(b, 1)
-        err2 = np.linalg.norm(Aeq * x_true - beq) / np.linalg.norm(beq, 1)
-        assert err1 < TOL, 'Ax!=b'
-        assert err2 < TOL, 'Aeq x!=beq'
+    return P, Aeq, beq, T, d
+
+
+def pathflow_lsq(A, b, Aeq, beq, method='pg', groups=None, x0=None):
+    """Solves min ||A*x-b|| s.t. Aeq*x=beq, x>=0 for feasible_pathflows
+    
+    Parameters
+    ----------
+    method: 'pg' for simplex_lsq if Aeq is a block simplex (else 'cp'),
+    'cp' for the least squares as a cvxopt.solvers.cp program
+    groups: if given, simplex_groups(Aeq)
+    x0: if given, initial point of simplex_lsq, e.g. the solution for other observations
+    """
+    n = A.size[1]
+    if method == 'pg' and groups is None: groups = simplex_groups(Aeq)
+    if method == 'pg' and groups is not None: return simplex_lsq(A, b, groups, beq, x0)
+    Aineq, bineq = spmatrix(-1.0, range(n), range(n)), matrix(0.0, (n,1)) # positive constraints
     # construct objective for cvxopt.solvers.qp
     Q, c = A.trans()*A, -A.trans()*b
     #x = solvers.qp(Q + REG_EPS*spmatrix(1.0, range(n), range(n)), c, Aineq, bineq, Aeq, beq)['x']
@@ -178,9 +427,46 @@ def feasible_pathflows(graph, l_obs, obs=None, update=False,
       return f, Df, z[0]*Q
   
     dims = {'l': n, 'q': [], 's': []}
-    x = solvers.cp(qp_objective, G=Aineq, h=bineq, A=Aeq, b=beq, 
+    return solvers.cp(qp_objective, G=Aineq, h=bineq, A=Aeq, b=beq, 
         kktsolver=get_kktsolver(Aineq, dims, Aeq, qp_objective))['x']
+
+
+def observed_lsq(constraints, l_obs, obs):
+    """Objective min ||A*x-b|| of feasible_pathflows for the links obs, given pathflow_constraints"""
+    P, Aeq, beq, T, d = constraints
+    A, b = (P[obs,:] if obs else P), l_obs # trim matrix if we have partial observations
+    if T is not None: A, b = sparse([A, T]), matrix([b, d]) # add the constraints to the objective
+    return A, b
+
+
+def check_pathflows(A, b, Aeq, beq, x_true):
+    """Assert that the true path flows x_true satisfy A*x=b and Aeq*x=beq"""
+    err1 =  np.linalg.norm(A * x_true - b, 1) / np.linalg.norm(b, 1)
+    err2 = np.linalg.norm(Aeq * x_true - beq) / np.linalg.norm(beq, 1)
+    assert err1 < TOL, 'Ax!=b'
+    assert err2 < TOL, 'Aeq x!=beq'
+
+
+def feasible_pathflows(graph, l_obs, obs=None, update=False,
+                       with_cell_paths=False, with_ODs=False, x_true=None, wp_trajs=None, method='pg'):
+    """Attempts to find feasible pathflows given partial of full linkflows
     
+    Parameters:
+    ----------
+    graph: Graph object
+    l_obs: observations of link flows
+    obs: indices of the observed links
+    update: if True, update path flows in graph
+    with_cell_paths: if True, include cell paths as constraints
+    with_ODs: if True, include ODs in the constraints if no with_cell_paths or in the objective if with_cell_paths
+    method: 'pg' for simplex_lsq if the constraints are a block simplex (else 'cp'),
+    'cp' for the least squares as a cvxopt.solvers.cp program
+    """
+    constraints = pathflow_constraints(graph, with_cell_paths, with_ODs, wp_trajs)
+    P, Aeq, beq = constraints[:3]
+    A, b = observed_lsq(constraints, l_obs, obs)
+    if x_true is not None: check_pathflows(A, b, Aeq, beq, x_true)
+    x = pathflow_lsq(A, b, Aeq, beq, method)
     if update:
         logging.info('Update link flows, delays in Graph.'); graph.update_linkflows_linkdelays(P*x)
         logging.info('Update path delays in Graph.'); graph.update_pathdelays()
@@ -189,5 +475,33 @@ def feasible_pathflows(graph, l_obs, obs=None, update=False,
     #rank = 5
     #if with_ODs == False:
     #    ipdb.set_trace()
-    return x, rn.rank(matrix([A, Aeq])), n
-    
\ No newline at end of file
+    return x, rn.rank(sparse([A, Aeq])), graph.numpaths
+
+
+def nested_pathflows(graph, l, observations, with_cell_paths=False, with_ODs=False,
+                     x_true=None, wp_trajs=None, method='pg'):
+    """feasible_pathflows for a sequence of sets of observed links, e.g. the nested sets
+    of the links with the most flow, the matrices that do not depend on the observed links
+    are built once and each solve is warm started from the solution for the previous set
+    
+    Parameters:
+    ----------
+    graph: Graph object
+    l: link flows, the observations of the links in obs are l[obs]
+    observations: list of lists obs of indices of observed links
+    other parameters: see feasible_pathflows
+    
+    Return value
+    ------------
+    list of (x, rank, dim) as returned by feasible_pathflows for each obs in observations
+    """
+    constraints = pathflow_constraints(graph, with_cell_paths, with_ODs, wp_trajs)
+    Aeq, beq = constraints[1:3]
+    groups = simplex_groups(Aeq) if method == 'pg' else None
+    results, x = [], None
+    for obs in observations:
+        A, b = observed_lsq(constraints, l[obs], obs)
+        if x_true is not None: check_pathflows(A, b, Aeq, beq, x_true)
+        x = pathflow_lsq(A, b, Aeq, beq, method, groups, x)
+        results.append((x, rn.rank(sparse([A, Aeq])), graph.numpaths))
+    return results
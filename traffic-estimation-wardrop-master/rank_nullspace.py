@@ -5,6 +5,24 @@ Created on Apr 22, 2014
 '''
 import numpy as np
 from numpy.linalg import svd
+import scipy.sparse as sps
+from scipy.linalg import qr
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.csgraph import structural_rank as sp_structural_rank
+from scipy.sparse.linalg import splu, spilu
+from cvxopt import spmatrix
+
+# sparse: if True, rank, nullspace and util.find_basis use the sparse routines below
+# for sparse inputs (cvxopt.spmatrix or scipy.sparse), dense inputs always use the svd
+# dense: blocks with at most dense rows or columns are factored dense, the others by sparse_lu
+# randomized: if not None, blocks with more than randomized rows and columns are first
+# ranked by randomized_rank
+options = {'sparse': True, 'dense': 200, 'randomized': None}
+# oversampling of the randomized rank estimate
+OVERSAMPLING = 10
+# perturbation d in the matrix S of pad and tolerance on the pivots of sparse_lu, relative to max|M|
+LU_PERTURB = 1e-14
+LU_TOL = 1e-7
 
 def rank(A, atol=1e-13, rtol=0):
     """Estimate the rank (i.e. the dimension of the nullspace) of a matrix.
@@ -41,6 +59,7 @@ def rank(A, atol=1e-13, rtol=0):
         provide the option of the absolute tolerance.
     """
 
+    if options['sparse'] and issparse(A): return sparse_rank(A, atol, rtol)
     A = np.atleast_2d(A)
     s = svd(A, compute_uv=False)
     tol = max(atol, rtol * s[0])
@@ -81,9 +100,248 @@ def nullspace(A, atol=1e-13, rtol=0):
         zero.
     """
 
+    if options['sparse'] and issparse(A): return sparse_nullspace(A, atol, rtol)
     A = np.atleast_2d(A)
     u, s, vh = svd(A)
     tol = max(atol, rtol * s[0])
     nnz = (s >= tol).sum()
     ns = vh[nnz:].conj().T
-    return ns
\ No newline at end of file
+    return ns
+
+
+def issparse(A):
+    """Return True if A is a cvxopt.spmatrix or a scipy.sparse matrix"""
+    return isinstance(A, spmatrix) or sps.issparse(A)
+
+
+def to_csc(A):
+    """Convert a cvxopt.spmatrix or a scipy.sparse matrix to scipy.sparse.csc_matrix"""
+    if isinstance(A, spmatrix):
+        colptr, rowind, values = A.CCS
+        return sps.csc_matrix((np.array(values).ravel(), np.array(rowind).ravel(),
+                               np.array(colptr).ravel()), shape=A.size)
+    return sps.csc_matrix(A)
+
+
+def blocks(A):
+    """Split A into independent blocks: connected components of the bipartite graph
+    of its rows and columns linked by the nonzero entries
+
+    Up to a permutation of the rows and of the columns, A is block-diagonal with these
+    blocks, its rank is the sum of their ranks and its nullspace is spanned by their
+    nullspaces, which is exact and much cheaper than a decomposition of the whole matrix
+
+    Return value
+    ------------
+    list of (rows, cols) of the blocks with at least one nonzero entry
+    """
+    A = to_csc(A)
+    A.eliminate_zeros()
+    m, n = A.shape
+    B = sps.bmat([[None, A], [A.T, None]], format='csr')
+    k, labels = connected_components(B, directed=False)
+    ind = np.argsort(labels, kind='mergesort')
+    ptr = np.searchsorted(labels[ind], np.arange(k+1))
+    result = []
+    for c in range(k):
+        nodes = ind[ptr[c]:ptr[c+1]]
+        rows, cols = nodes[nodes < m], nodes[nodes >= m] - m
+        if len(rows) > 0 and len(cols) > 0: result.append((rows, cols))
+    return result
+
+
+def structural_rank(A):
+    """Structural rank of A: maximum matching between its rows and columns
+    along the nonzero entries, an upper bound on the rank"""
+    A = to_csc(A)
+    A.eliminate_zeros()
+    return sp_structural_rank(A.tocsr())
+
+
+def pivoted_qr(M, atol=1e-13, rtol=0):
+    """Rank-revealing QR decomposition with column pivoting of a dense block
+
+    Return value
+    ------------
+    r: numerical rank, number of diagonal entries of R larger than max(atol, rtol*|R[0,0]|)
+    cols: pivot columns, cols[:r] index independent columns of M
+    """
+    R, cols = qr(M, mode='r', pivoting=True)
+    d = np.abs(np.diag(R))
+    if len(d) == 0: return 0, cols
+    tol = max(atol, rtol * d[0])
+    return int((d >= tol).sum()), cols
+
+
+def pad(M, order):
+    """Non-singular matrix S = [M[:,order], s*I; d*I, 0] of sparse_lu with s = max|M|
+    and d = LU_PERTURB*s"""
+    m, n = M.shape
+    scale = np.abs(M.data).max()
+    M = M[:,order].tocoo()
+    return sps.csc_matrix((np.r_[M.data, np.ones(n)*LU_PERTURB*scale, np.ones(m)*scale],
+                           (np.r_[M.row, m + np.arange(n), np.arange(m)],
+                            np.r_[M.col, np.arange(n), n + np.arange(m)])), shape=(m+n, m+n))
+
+
+def colamd(S):
+    """COLAMD order of the columns of a square sparse matrix S: perm_c of the cheap incomplete
+    LU decomposition of S by SuperLU, or if it meets a zero pivot, of a strictly diagonally
+    dominant matrix with the pattern of S and of the identity"""
+    options = dict(Equil=False)
+    try: return spilu(S, drop_tol=1.0, options=options).perm_c
+    except RuntimeError: pass
+    S = sps.csc_matrix((np.ones(S.nnz), S.indices, S.indptr), shape=S.shape)
+    S = S + sps.diags(np.diff(S.indptr) + 1.0, 0)
+    return spilu(S.tocsc(), drop_tol=1.0, options=options).perm_c
+
+
+def sparse_lu(M, atol=1e-13, rtol=0, full=False):
+    """Rank-revealing sparse LU decomposition of a sparse matrix with partial pivoting
+    
+    The m x n matrix M is embedded in the non-singular matrix S of pad, its columns are
+    eliminated first, in the COLAMD order of S (see colamd), so that a column of M in the span
+    of the columns eliminated before it is pivoted on its row of d*I with a pivot of the order
+    of d, and the rows of M are only pivoted on by the independent columns. A column pivoted
+    on a row of M with a pivot below tol = max(atol, (rtol+LU_TOL)*max|M|) is nearly in the
+    span of the columns before it but would take the row of a later independent column,
+    these columns are removed and the others factored again until there are none.
+    SuperLU may still permute the columns of S along its column elimination tree (perm_c),
+    the columns of s*I it moves before columns of M are then in other subtrees and do not
+    change their pivots. If M is tall, it is first restricted to the independent rows
+    given by sparse_lu(M.T)
+    
+    Return value
+    ------------
+    r: numerical rank
+    cols: sorted indices of r independent columns of M
+    rows: if full, rows of M pivoted on by cols, M[rows,cols] is non-singular
+    """
+    M = to_csc(M)
+    M.eliminate_zeros()
+    m, n = M.shape
+    rows, cols = np.arange(m), np.arange(n)
+    if m > n: rows = sparse_lu(M.T, atol, rtol)[1]; M = M[rows,:]
+    tol = max(atol, (rtol + LU_TOL) * np.abs(M.data).max()) if M.nnz > 0 else 0.0
+    piv_cols, piv_rows = np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    while len(cols) > 0:
+        N = M[:,cols]
+        if N.nnz == 0: break
+        order = np.argsort(colamd(pad(N, np.arange(len(cols))))[:len(cols)])
+        lu = splu(pad(N, order), permc_spec='NATURAL', diag_pivot_thresh=1.0, options=dict(Equil=False))
+        steps = lu.perm_c[:len(cols)] # column j of S is eliminated at step perm_c[j]
+        pivots = np.argsort(lu.perm_r)[steps] # row of S of the pivot of column j
+        real = pivots < N.shape[0]
+        weak = real & (np.abs(lu.U.diagonal()[steps]) <= tol)
+        piv_cols, piv_rows = cols[order[real]], rows[pivots[real]]
+        if not weak.any(): break
+        cols = np.sort(cols[order[~weak]])
+    ind = np.argsort(piv_cols)
+    if full: return len(ind), piv_cols[ind], piv_rows[ind]
+    return len(ind), piv_cols[ind]
+
+
+def leading_ranks(A, sizes, atol=1e-13, rtol=0):
+    """Ranks of the leading rows A[:k,:] of a sparse matrix for each k in sizes (increasing)
+    a basis of the rows of A[:k,:] is updated from one size to the next with sparse_lu of
+    the transpose of the rows of the basis and of the new rows only
+    """
+    A = to_csc(A).tocsr()
+    basis, ranks, start = np.zeros(0, dtype=int), [], 0
+    for k in sizes:
+        rows = np.r_[basis, np.arange(start, k)].astype(int)
+        if len(rows) > 0: basis = rows[sparse_lu(A[rows,:].T)[1]]
+        ranks.append(len(basis)); start = max(start, k)
+    return ranks
+
+
+def randomized_rank(A, rtol=1e-10, seed=0):
+    """Randomized estimate of the rank of a sparse matrix
+    A*W with W a gaussian matrix with k columns has rank min(rank(A), k) with probability one,
+    A is sketched with k = 2*OVERSAMPLING, 4*OVERSAMPLING, ... columns until A*W is rank
+    deficient, only a small dense QR of the sketch is computed each time, if k reaches
+    half the smaller dimension of A, the rank is not small and sparse_lu is used instead
+    
+    Parameters
+    ----------
+    A: scipy.sparse matrix
+    rtol: relative tolerance on the diagonal of R in the pivoted QR of A*W
+    """
+    A = to_csc(A)
+    if A.shape[0] > A.shape[1]: A = A.T.tocsc() # sketch of the smaller dimension
+    m, n = A.shape
+    W, k = np.zeros((n, 0)), 2*OVERSAMPLING
+    rand = np.random.RandomState(seed)
+    while 2*k < m:
+        W = np.hstack((W, rand.randn(n, k - W.shape[1])))
+        r = pivoted_qr(A.dot(W), 0.0, rtol)[0]
+        if r < k: return r
+        k *= 2
+    return sparse_lu(A, 0.0, rtol)[0]
+
+
+def sparse_rank(A, atol=1e-13, rtol=0):
+    """Rank of a sparse matrix, see rank
+
+    The rank is summed over the blocks of A (see blocks), each block is ranked by
+    a QR decomposition with column pivoting if it has at most options['dense'] rows or
+    columns, else by sparse_lu, or by randomized_rank if it has more than
+    options['randomized'] rows and columns
+    """
+    A, r = to_csc(A), 0
+    for rows, cols in blocks(A):
+        M = A[rows,:][:,cols]
+        if M.shape[0] > M.shape[1]: M = M.T # no restriction to the independent rows in sparse_lu
+        if min(M.shape) <= options['dense']: r += pivoted_qr(M.toarray(), atol, rtol)[0]
+        elif options['randomized'] is not None and min(M.shape) > options['randomized']:
+            r += randomized_rank(M, max(rtol, 1e-10))
+        else: r += sparse_lu(M, atol, rtol)[0]
+    return r
+
+
+def sparse_nullspace(A, atol=1e-13, rtol=0):
+    """Basis of the nullspace of a sparse matrix, see nullspace
+
+    The columns of A outside of all blocks are zero and give unit vectors of the basis,
+    the nullspace of each block is computed with the svd of the block if it has at most
+    options['dense'] rows and columns, else from sparse_lu: with B the independent columns
+    and R their pivot rows in the block M, the nullspace is spanned by the columns of
+    [-M[R,B]^-1*M[R,N]; I] on the columns (B, N), N the other columns (not orthonormal)
+    """
+    A = to_csc(A)
+    n = A.shape[1]
+    free = np.ones(n, dtype=bool)
+    vectors = []
+    for rows, cols in blocks(A):
+        free[cols] = False
+        M = A[rows,:][:,cols]
+        if max(M.shape) <= options['dense']:
+            ns = nullspace(M.toarray(), atol, rtol)
+        else:
+            B, R = sparse_lu(M, atol, rtol, True)[1:]
+            N = np.setdiff1d(np.arange(M.shape[1]), B)
+            ns = np.zeros((M.shape[1], len(N)))
+            if len(N) > 0:
+                MR = M[R,:]
+                ns[B,:] = -splu(MR[:,B].tocsc(), options=dict(Equil=False)).solve(MR[:,N].toarray())
+                ns[N,:] = np.eye(len(N))
+        if ns.shape[1] == 0: continue
+        v = np.zeros((n, ns.shape[1]))
+        v[cols,:] = ns
+        vectors.append(v)
+    vectors.append(np.eye(n)[:,free])
+    return np.hstack(vectors)
+
+
+def sparse_basis(M, atol=1e-13):
+    """Indices of columns of a sparse matrix M that form a basis of range(M), see util.find_basis
+    the pivot columns of the QR decomposition of each block with at most options['dense']
+    rows or columns, else of its sparse_lu"""
+    M, ind = to_csc(M), []
+    for rows, cols in blocks(M):
+        B = M[rows,:][:,cols]
+        if min(B.shape) <= options['dense']:
+            r, piv = pivoted_qr(B.toarray(), atol)
+            ind.extend(cols[piv[:r]].tolist())
+        else: ind.extend(cols[sparse_lu(B, atol)[1]].tolist())
+    return sorted(ind)
@@ -0,0 +1,140 @@
+'''
+Benchmark of the sparse rank routines on the matrices of the solvers
+'''
+
+import rank_nullspace as rn
+import Graph as g
+import ue_solver as ue
+import inverse_opt as invopt
+import path_solver as path
+from util import find_basis
+from generate_graph import los_angeles
+from generate_paths import get_path_set, add_path_set
+from cvxopt import matrix, sparse
+import numpy as np
+import scipy.sparse as sps
+import time
+
+theta = matrix([0.0, 0.0, 0.0, 0.15])
+
+
+def compare(name, A):
+    """Compare the dense and sparse ranks of A and their running times"""
+    start = time.clock()
+    r1 = rn.rank(matrix(A))
+    t1 = time.clock() - start
+    start = time.clock()
+    r2 = rn.rank(sparse(A))
+    t2 = time.clock() - start
+    rn.options['randomized'] = 0
+    start = time.clock()
+    r3 = rn.rank(sparse(A))
+    t3 = time.clock() - start
+    rn.options['randomized'] = None
+    print '{} {}: rank svd {} ({:.3f}s), lu {} ({:.3f}s), randomized {} ({:.3f}s), structural {}'.format(
+        name, A.size, r1, t1, r2, t2, r3, t3, rn.structural_rank(sparse(A)))
+
+
+def test1():
+    """Node-link incidence matrix and basis of its rows from ue.nodelink_incidence"""
+    g = los_angeles(theta, 'Polynomial')[0]
+    C = ue.nodelink_incidence(g)[0]
+    compare('node-link incidence', C)
+    start = time.clock()
+    ind1 = find_basis(matrix(C.T))
+    t1 = time.clock() - start
+    start = time.clock()
+    ind2 = find_basis(C.T)
+    t2 = time.clock() - start
+    print 'basis: dense lu {} rows ({:.3f}s), sparse lu {} rows ({:.3f}s)'.format(len(ind1), t1, len(ind2), t2)
+
+
+def test2(K=5):
+    """[A; Aeq] of path.feasible_pathflows with the K shortest paths of all the OD pairs"""
+    g = los_angeles(theta, 'Polynomial')[3]
+    ue.solver(g, update=True)
+    add_path_set(g, get_path_set(g, K, 1))
+    A, Aeq = path.linkpath_incidence(g), path.path_to_OD_simplex(g)[0]
+    compare('link-path and path-OD incidence', sparse([A, Aeq]))
+
+
+def test3(degree=4):
+    """Matrix of the LP of invopt.solver for the four demand levels"""
+    graphs = los_angeles(theta, 'Polynomial')
+    ls = [ue.solver(g) for g in graphs]
+    A = invopt.constraints(invopt.get_data(graphs), ls, degree)[1]
+    compare('inverse optimization LP', A)
+
+
+def test4(trials=100, seed=0):
+    """Sparse rank, basis and nullspace against the svd on random low-rank sparse matrices
+    with all the blocks factored by sparse_lu"""
+    rs = np.random.RandomState(seed)
+    dense, rn.options['dense'] = rn.options['dense'], 0
+    try:
+        for t in range(trials):
+            m, n, k = rs.randint(20, 150, 3)
+            A = sps.csc_matrix(sps.random(m, k, 0.1, random_state=rs) * sps.random(k, n, 0.1, random_state=rs))
+            M = A.toarray()
+            r = rn.rank(M)
+            assert rn.rank(A) == r, 'rank'
+            ind = rn.sparse_basis(A)
+            assert len(ind) == r and rn.rank(M[:,ind]) == r, 'basis'
+            ns = rn.nullspace(A)
+            assert ns.shape[1] == n - r, 'nullspace dimension'
+            if r == n: continue
+            assert rn.rank(ns) == n - r, 'nullspace dimension'
+            assert np.abs(M.dot(ns)).max() <= 1e-8 * max(1.0, np.abs(ns).max()), 'nullspace'
+    finally:
+        rn.options['dense'] = dense
+    print 'rank, basis and nullspace agree with the svd on {} random matrices'.format(trials)
+
+
+def grid_graph(k, K=3, seed=0):
+    """k x k grid with links in both directions, 2k random OD pairs and their K shortest paths"""
+    rs = np.random.RandomState(seed)
+    graph = g.Graph('{}x{} grid'.format(k, k))
+    for i in range(k):
+        for j in range(k): graph.add_node((i, j))
+    for i in range(k):
+        for j in range(k):
+            for a,b in [(i+1, j), (i-1, j), (i, j+1), (i, j-1)]:
+                if 0 <= a < k and 0 <= b < k:
+                    graph.add_link(i*k+j+1, a*k+b+1, delayfunc=g.create_delayfunc('Polynomial', (1.0, 1.0, [1.0])))
+    while len(graph.ODs) < 2*k:
+        o, d = [int(v) + 1 for v in rs.choice(k*k, 2, replace=False)]
+        if (o, d) not in graph.ODs: graph.add_od(o, d, 1.0)
+    add_path_set(graph, get_path_set(graph, K, 1))
+    return graph
+
+
+def test5(trials=100, seed=0):
+    """leading_ranks against the svd on [Aeq; A] of nested_pathflows with shuffled link rows
+    on synthetic grids and on random sparse matrices"""
+    rs = np.random.RandomState(seed)
+    matrices = []
+    for k in [4, 6, 8, 10]:
+        graph = grid_graph(k)
+        P, Aeq = path.linkpath_incidence(graph), path.path_to_OD_simplex(graph)[0]
+        A = rn.to_csc(sparse([Aeq, P[rs.permutation(P.size[0]).tolist(),:]]))
+        matrices.append((A, [Aeq.size[0] + (j*P.size[0])/3 for j in range(1, 4)]))
+    for t in range(trials):
+        m, n = rs.randint(20, 150, 2)
+        A = sps.csc_matrix(sps.random(m, n, rs.uniform(0.01, 0.1), random_state=rs))
+        matrices.append((A, sorted(rs.randint(0, m+1, 4))))
+    for A, sizes in matrices:
+        M = A.toarray()
+        assert rn.leading_ranks(A, sizes) == [rn.rank(M[:k,:]) if k > 0 else 0 for k in sizes], 'leading ranks'
+    print 'leading_ranks agree with the svd on {} matrices'.format(len(matrices))
+
+
+def main():
+    test4()
+    test5()
+    test1()
+    #test2()
+    #test3()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,72 @@ Created on Aug 7, 2014
 
 
 import numpy as np
+import heapq
+
+
+def link_delays(graph):
+    """Get the current link delays as a numpy array indexed by graph.indlinks"""
+    return np.array([graph.links[id].delay for id in graph.get_arrays().link_ids], dtype=float)
+
+
+def shortest_path_tree(arrays, delays, sink, targets=None, blocked=None, forward=False):
+    """Binary-heap Dijkstra towards sink over the in-link CSR adjacency of the graph
+    (or from sink over the out-link CSR adjacency if forward is True)
+    Stops as soon as all the targets have been settled
+    
+    Parameters
+    ----------
+    arrays: GraphArrays object from graph.get_arrays()
+    delays: numpy array of link delays, np.inf removes a link
+    sink: 0-based index of the sink
+    targets: 0-based indices of the sources, if None compute the whole tree
+    blocked: 0-based indices of nodes that the paths must avoid
+    forward: if True, tree of the shortest paths from sink to the other nodes
+    
+    Return value:
+    -------------
+    dist: dist[u] = distance from u to sink (from sink to u if forward) (list)
+    next: next[u] = index of the first link in the shortest path from u to sink
+    (of the last link in the shortest path from sink to u if forward), -1 if none (list)
+    order: settled nodes by increasing distance to sink (list)
+    """
+    m = arrays.numnodes
+    if forward: in_ptr, in_links, startnodes = arrays.out_ptr, arrays.out_links, arrays.endnodes
+    else: in_ptr, in_links, startnodes = arrays.in_ptr, arrays.in_links, arrays.startnodes
+    in_ptr, in_links, startnodes, delays = in_ptr.tolist(), in_links.tolist(), startnodes.tolist(), delays.tolist()
+    dist, next, done, order = [np.inf]*m, [-1]*m, [False]*m, []
+    if blocked is not None:
+        for u in blocked: done[u] = True
+    dist[sink] = 0.0
+    heap = [(0.0, sink)]
+    remaining = None if targets is None else set(targets)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if done[u]: continue
+        done[u] = True
+        order.append(u)
+        if remaining is not None:
+            remaining.discard(u)
+            if len(remaining) == 0: break
+        for k in in_links[in_ptr[u]:in_ptr[u+1]]:
+            v, alt = startnodes[k], d + delays[k]
+            if alt < dist[v] and not done[v]:
+                dist[v], next[v] = alt, k
+                heapq.heappush(heap, (alt, v))
+    return dist, next, order
+
+
+def reverse_dijkstra(arrays, delays, sink, targets=None, blocked=None):
+    """Shortest path tree towards sink (see shortest_path_tree)
+    
+    Return value:
+    -------------
+    dist: dist[u] = distance from u to sink (list)
+    next: next[u] = index of the next node in the shortest path from u to sink, -1 if none (list)
+    """
+    dist, next, order = shortest_path_tree(arrays, delays, sink, targets, blocked)
+    endnodes = arrays.endnodes.tolist()
+    return dist, [-1 if k < 0 else endnodes[k] for k in next]
 
 
 def Dijkstra(graph, sink, sources=None):
@@ -19,23 +85,9 @@ def Dijkstra(graph, sink, sources=None):
     next: next[u] = next node in the shortest path from u to sink
     """
     n = graph.numnodes
-    dist = {k+1:np.inf for k in range(n)}
-    next = {k+1:None for k in range(n)}
-    dist[sink] = 0.0
-    S, Q = list(sources[:]), range(1,n+1)
-    while len(Q)>0:
-        min = np.inf
-        for v in Q:
-            if dist[v] < min: u=v; min = dist[v]
-        if min == np.inf: return dist, next
-        for s in S:
-            if u == s: S.remove(u)
-        if len(S)==0: return dist,next
-        Q.remove(u)
-        for link in graph.nodes[u].inlinks.values():
-            v, alt = link.startnode, dist[u] + link.delay
-            if alt < dist[v]: dist[v] = alt; next[v] = u
-    return dist, next
+    targets = None if sources is None else [s-1 for s in sources]
+    dist, next = reverse_dijkstra(graph.get_arrays(), link_delays(graph), sink-1, targets)
+    return {k+1:dist[k] for k in range(n)}, {k+1:(None if next[k] < 0 else next[k]+1) for k in range(n)}
 
 
 def get_path(source, sink, next):
@@ -50,57 +102,76 @@ def get_path(source, sink, next):
     return path
 
 
-def mainKSP(graph, sources, sink, K):
+def mainKSP(graph, sources, sink, K, delays=None):
     """Find the K-shortest paths from sources to sink
+    The graph is not modified, so mainKSP can run for several sinks concurrently
+    
+    Parameters:
+    -----------
+    graph: Graph object
+    sources: list of source ids
+    sink: id of the sink
+    K: number of shortest paths
+    delays: numpy array of link delays indexed by graph.indlinks, if None use the current delays
     
     Return value:
     -------------
     As: dictionary s.t. As[s]=[K-shortest paths from s to sink for s in sources]
     """
-    dist, next = Dijkstra(graph, sink, sources)
-    A0s = {s:get_path(s, sink, next) for s in sources}
-    return {s : YenKSP(graph, s, sink, K, A0s[s]) for s in sources}
-            
-            
-def YenKSP(graph, source, sink, K, A0):
+    arrays = graph.get_arrays()
+    if delays is None: delays = link_delays(graph)
+    dist, next = reverse_dijkstra(arrays, delays, sink-1, [s-1 for s in sources])
+    As = {}
+    for s in sources:
+        if next[s-1] < 0: As[s] = []; continue
+        u, A0 = s-1, [s]
+        while u != sink-1: u = next[u]; A0.append(u+1)
+        As[s] = YenKSP(graph, s, sink, K, A0, delays)
+    return As
+
+
+def edge_links(arrays, u, v):
+    """Get the indices of the links from node u to node v (0-based)"""
+    out = arrays.out_links[arrays.out_ptr[u]:arrays.out_ptr[u+1]]
+    return out[arrays.endnodes[out] == v]
+
+
+def YenKSP(graph, source, sink, K, A0, delays=None):
     """"Find the k-shortest paths from source to sink
     A0: initialization with the shortest path from source to sink
+    delays: numpy array of link delays indexed by graph.indlinks, if None use the current delays
     {see http://en.wikipedia.org/wiki/Yen's_algorithm}
+    
+    Edges and nodes are removed with masks local to the call, the graph is not modified.
+    Candidates are kept in a heap and deduplicated by path, so that alternative
+    paths of equal cost are kept
     """
-    A, B, costs, j, tmp, k2 = [A0], {}, {}, 0, {}, 0
+    arrays = graph.get_arrays()
+    if delays is None: delays = link_delays(graph)
+    cost = {}
+    def edge_cost(u, v):
+        if (u,v) not in cost: cost[(u,v)] = delays[edge_links(arrays, u-1, v-1)].min()
+        return cost[(u,v)]
+    A, B, seen = [list(A0)], [], set([tuple(A0)])
     for k in range(K-1):
-        for i in range(len(A[k2])-1):
-            spurNode, rootPath = A[k2][i], A[k2][:i+1]
-            costRootPath = 0
-            for l in range(i):
-                costRootPath += graph.links[(A[k2][l],A[k2][l+1],1)].delay
+        last = A[-1]
+        costRootPath = 0.0
+        for i in range(len(last)-1):
+            spurNode, rootPath = last[i], last[:i+1]
+            removed = np.zeros(len(delays), dtype=bool)
             for p in A:
-                if rootPath == p[:i+1]:
-                    if (p[i],p[i+1],1) not in tmp.keys():
-                        link = graph.links[(p[i],p[i+1],1)]
-                        tmp[(p[i],p[i+1],1)] = link.delay #save p.edge(i, i + 1)
-                        link.delay = np.inf #remove p.edge(i, i + 1)
-            for node in rootPath:
-                for link in graph.nodes[node].inlinks.values():
-                    if (link.startnode,node,1) not in tmp.keys():
-                        tmp[(link.startnode,node,1)] = link.delay #save edge
-                        link.delay = np.inf #remove edge
-            dist, next = Dijkstra(graph, sink, [spurNode])
-            cost = costRootPath + dist[spurNode]
-            if dist[spurNode] < np.inf and cost not in costs.values():
-                B[j] = rootPath[:-1] + get_path(spurNode, sink, next)
-                costs[j] = cost
-                j += 1
-            for id,delay in tmp.items(): graph.links[id].delay = delay
-            tmp = {}
+                if p[:i+1] == rootPath: removed[edge_links(arrays, p[i]-1, p[i+1]-1)] = True
+            dist, next = reverse_dijkstra(arrays, np.where(removed, np.inf, delays), sink-1,
+                                          [spurNode-1], [u-1 for u in rootPath[:-1]])
+            if dist[spurNode-1] < np.inf:
+                u, path = spurNode-1, rootPath[:]
+                while u != sink-1: u = next[u]; path.append(u+1)
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    heapq.heappush(B, (costRootPath + dist[spurNode-1], path))
+            costRootPath += edge_cost(last[i], last[i+1])
         if len(B) == 0: break
-        min_cost = min(costs.values())
-        for key,cost in costs.items():    
-            if cost == min_cost:
-                A.append(B[key]); k2+=1
-                del costs[key]
-                del B[key]
-                break
+        A.append(heapq.heappop(B)[1])
     return A
                 
             
@@ -5,7 +5,10 @@ Created on Aug 7, 2014
 '''
 
 import shortest_paths as sh
-from generate_graph import los_angeles
+import numpy as np
+import time
+from cvxopt import matrix
+from generate_graph import los_angeles, los_angeles_2
 
 
 def test1():
@@ -18,8 +21,63 @@ def test1():
         print len(As[s]), As[s]
     
 
+def Dijkstra_scan(graph, sink, sources):
+    """Reference O(n^2) implementation of sh.Dijkstra used for test2"""
+    n = graph.numnodes
+    dist = {k+1:np.inf for k in range(n)}
+    next = {k+1:None for k in range(n)}
+    dist[sink] = 0.0
+    S, Q = list(sources[:]), range(1,n+1)
+    while len(Q)>0:
+        min = np.inf
+        for v in Q:
+            if dist[v] < min: u=v; min = dist[v]
+        if min == np.inf: return dist, next
+        for s in S:
+            if u == s: S.remove(u)
+        if len(S)==0: return dist,next
+        Q.remove(u)
+        for link in graph.nodes[u].inlinks.values():
+            v, alt = link.startnode, dist[u] + link.delay
+            if alt < dist[v]: dist[v] = alt; next[v] = u
+    return dist, next
+
+
+def test2():
+    """Benchmark heap-based Dijkstra against the linear-scan implementation
+    on los_angeles and los_angeles_2, for the sources of each sink and for whole trees"""
+    theta = matrix([0.0, 0.0, 0.0, 0.15])
+    for name, g in [('los_angeles', los_angeles()[0]), ('los_angeles_2', los_angeles_2(theta, 'Polynomial'))]:
+        sinks = [id for id,node in g.nodes.items() if len(node.endODs) > 0]
+        all_nodes = range(1, g.numnodes+1)
+        for label, get_sources in [('sources', lambda t: [od[0] for od in g.ODs.keys() if od[1]==t]),
+                                   ('all nodes', lambda t: all_nodes)]:
+            t1, t2, same = 0.0, 0.0, True
+            for t in sinks:
+                sources = get_sources(t)
+                start = time.clock(); dist1, next1 = sh.Dijkstra(g, t, sources); t1 += time.clock() - start
+                start = time.clock(); dist2, next2 = Dijkstra_scan(g, t, sources); t2 += time.clock() - start
+                same = same and all([dist1[s] == dist2[s] for s in sources])
+            print '{}, {}: heap {:.2e}s, scan {:.2e}s, same distances: {}'.format(name, label, t1, t2, same)
+
+
+def test3(K=10):
+    """Check that YenKSP leaves the graph untouched and returns distinct paths by increasing cost"""
+    g = los_angeles()[0]
+    delays = sh.link_delays(g)
+    sink = 20
+    sources = [od[0] for od in g.ODs.keys() if od[1]==sink]
+    As = sh.mainKSP(g, sources, sink, K)
+    print 'graph untouched:', np.all(delays == sh.link_delays(g))
+    for s in sources:
+        costs = [sum([g.links[(p[i],p[i+1],1)].delay for i in range(len(p)-1)]) for p in As[s]]
+        print s, len(As[s]), len(set(map(tuple, As[s]))) == len(As[s]), costs == sorted(costs)
+
+
 def main():
     test1()
+    #test2()
+    #test3()
 
 
 if __name__ == '__main__':
@@ -7,21 +7,18 @@ Created on Sep 9, 2014
 import numpy as np
 import ue_solver as ue
 import inverse_opt as invopt
-from cvxopt import matrix, spdiag, solvers, div
+import logging
+import time
+from cvxopt import matrix, spmatrix, spdiag, solvers
+from Graph import DelayModel
+from kktsolver import kkt_blocks
 
 
 def compute_delays(l, ffdelays, pm, type='Polynomial'):
     """Compute delays given linkflows l"""
-    n, d = pm.size
-    delays = matrix(0.0, (n,1))
-    if type == 'Polynomial':
-        for i in range(n):
-            delays[i] = ffdelays[i] + pm[i,:] * matrix(np.power(l[i],range(1,d+1)))
-    if type == 'Hyperbolic':
-        ks = matrix([[ffdelays-div(pm[:,0],pm[:,1])], [pm]])
-        for i in range(n):
-            delays[i] = ks[i,0] + ks[i,1]/(ks[i,2]-l[i])
-    return delays
+    if type == 'Polynomial': model = DelayModel(ffdelays, type, coefs=pm)
+    if type == 'Hyperbolic': model = DelayModel(ffdelays, type, ks=pm)
+    return matrix(model.delays(l))
 
 
 def compute_cost(data, toll=None, SO=False):
@@ -42,7 +39,35 @@ def compute_cost(data, toll=None, SO=False):
     return (delays.T*x)[0], x
 
 
-def ty_solver(data, l, w_toll, full=False):
+def ty_constraints(Aeq, n):
+    """Constraints G*[t; y] <= h of the block (t,y) of the toll pricing model
+    -t + Aeq_k'*y_k <= delays for each destination k and -t <= 0,
+    G does not depend on l and is shared by the iterations of solver
+    
+    Parameters
+    ----------
+    Aeq: UE equality constraints
+    n: number of links
+    
+    Return value
+    ------------
+    G: sparse matrix of the constraints
+    kktsolver: kktsolver.kkt_blocks with the tolls coupling the blocks (rows, cols) of
+    the destinations, it keeps the symbolic factorizations across the calls to solvers.lp
+    """
+    p = Aeq.size[1]/n
+    m = Aeq.size[0]/p
+    I, J, V = np.array(Aeq.I).ravel(), np.array(Aeq.J).ravel(), np.array(Aeq.V).ravel()
+    rows = np.concatenate([np.arange((p+1)*n), J])
+    cols = np.concatenate([np.tile(np.arange(n), p+1), I + n])
+    values = np.concatenate([-np.ones((p+1)*n), V])
+    G = spmatrix(values, rows, cols, ((p+1)*n, n+p*m))
+    dims = {'l': (p+1)*n, 'q': [], 's': []}
+    blocks = [(range(k*n, (k+1)*n), range(n+k*m, n+(k+1)*m)) for k in range(p)]
+    return G, kkt_blocks(G, dims, n, blocks)
+
+
+def ty_solver(data, l, w_toll, full=False, lp=None):
     """Solves the block (t,y) of the toll pricing model
     
     Parameters
@@ -51,25 +76,22 @@ def ty_solver(data, l, w_toll, full=False):
     l: linkflows
     w_toll: weight on the toll collected
     full: if True, return the whole solution
+    lp: if given, (G, kktsolver) from ty_constraints(Aeq, n)
     """
     Aeq, beq, ffdelays, coefs = data
     delays = compute_delays(l, ffdelays, coefs)
     n = len(l)
     p = Aeq.size[1]/n
-    m = Aeq.size[0]/p
+    if lp is None: lp = ty_constraints(Aeq, n)
+    G, kktsolver = lp
     c = matrix([(1.0+w_toll)*l, -beq])
-    I = spdiag([1.0]*n)
-    G1 = matrix([-I]*(p+1))
-    G2 = matrix([Aeq.T, matrix(0.0, (n,p*m))])
-    G = matrix([[G1],[G2]])
-    h = [delays]*p
-    h.append(matrix(0.0, (n,1)))
-    h = matrix(h)
-    if full: return solvers.lp(c,G,h)['x']
-    return solvers.lp(c,G,h)['x'][range(n)]
-
-
-def solver(data, w_so, w_toll, max_iter=5, full=False):
+    h = matrix([delays]*p + [matrix(0.0, (n,1))])
+    x = solvers.lp(c, G, h, kktsolver=kktsolver)['x']
+    if full: return x
+    return x[range(n)]
+
+
+def solver(data, w_so, w_toll, max_iter=5, full=False, warm=True):
     """Solves the toll pricing problem
     
     Parameters
@@ -79,22 +101,122 @@ def solver(data, w_so, w_toll, max_iter=5, full=False):
     w_toll: weight on the toll collected
     max_iter: maximum number of iterations
     full: if False, return toll, if True, return toll, y, l
+    warm: if True, warm start x_solver with its solution at the previous iteration
     """
     Aeq, beq, ffdelays, coefs = data
     n = len(ffdelays)
     p = Aeq.size[1]/n
-    toll = matrix(100.0, (n,1))
+    toll, x0 = matrix(100.0, (n,1)), None
+    lp = ty_constraints(Aeq, n)
     for k in range(max_iter):
-        l = invopt.x_solver(ffdelays+((1.+w_toll)/(1.+w_so))*toll, coefs, Aeq, beq)
-        print (compute_delays(l, ffdelays, coefs).T*l)[0]
-        toll = ty_solver(data, l, w_toll)
+        l, x = invopt.x_solver(ffdelays+((1.+w_toll)/(1.+w_so))*toll, coefs, Aeq, beq, x0=x0, full=True)
+        if warm: x0 = x
+        logging.info('Toll iteration {}: total delay {}'.format(k, (compute_delays(l, ffdelays, coefs).T*l)[0]))
+        toll = ty_solver(data, l, w_toll, lp=lp)
     if full:
-        sol = ty_solver(data, l, w_toll, True)
+        sol = ty_solver(data, l, w_toll, True, lp)
         return sol[:n], sol[n:], l # return toll, y, l
     return toll
 
 
-def main_solver(graph, theta, ws=[1e-6], max_iter=5):
+def toll_point(data, w_so, w_toll, max_iter=5):
+    """Solve one point of the grid of toll_grid
+    
+    Parameters
+    ----------
+    data: Aeq, beq, ffdelays, coefs
+    w_so: weight on the SO objective
+    w_toll: weight on the toll collected
+    max_iter: maximum number of iterations
+    
+    Return value
+    ------------
+    toll: toll from solver(data, w_so, w_toll, max_iter)
+    gap, cost_est, toll_est: gap function, total travel time and toll collected
+    for the link flows estimated by solver
+    cost, toll_collected: total travel time and toll collected in the tolled UE
+    """
+    Aeq, beq, ffdelays, coefs = data
+    toll, y, l = solver(data, w_so, w_toll, max_iter, True)
+    gap = compute_gap(l, y, matrix([[ffdelays], [coefs]]), toll, beq, 1.0)
+    cost_est = (compute_delays(l, ffdelays, coefs).T*l)[0]
+    cost, x = compute_cost((Aeq, beq, ffdelays, coefs, 'Polynomial'), toll)
+    return toll, (gap, cost_est, (toll.T*l)[0], cost, (toll.T*x)[0])
+
+
+def toll_task(args):
+    """Solve toll_point in a worker of an invopt.XSolverPool, return (k, result, running time)"""
+    k, beq, coefs, w_so, w_toll, max_iter = args
+    start = time.time()
+    result = toll_point((invopt.worker['Aeq'], beq, invopt.worker['ffdelays'], coefs), w_so, w_toll, max_iter)
+    return k, result, time.time() - start
+
+
+def pareto(costs, tolls):
+    """Mask of the points (costs[k], tolls[k]) that are not dominated by another point,
+    i.e. no other point has a smaller or equal cost and toll collected, one of them smaller"""
+    costs, tolls = np.asarray(costs), np.asarray(tolls)
+    mask = np.ones(len(costs), dtype=bool)
+    for k in range(len(costs)):
+        dominated = (costs <= costs[k]) & (tolls <= tolls[k]) & ((costs < costs[k]) | (tolls < tolls[k]))
+        mask[k] = not dominated.any()
+    return mask
+
+
+def toll_grid(data, ws, max_iter=5, processes=1, path=None):
+    """Evaluate the toll pricing model on a grid of weights
+    
+    The points are solved in parallel if processes > 1 by an invopt.XSolverPool
+    holding Aeq and ffdelays in shared memory, only the scalar results of each point
+    are kept, with the tolls of the points on the Pareto front of (cost, toll_collected)
+    
+    Parameters
+    ----------
+    data: Aeq, beq, ffdelays, coefs
+    ws: list of weights (w_so, w_toll)
+    max_iter: maximum number of iterations of solver
+    processes: if > 1, number of processes solving the points in parallel
+    path: if given, write the columns and the tolls of the Pareto front with numpy.savez
+    
+    Return value
+    ------------
+    columns: dictionary of numpy arrays indexed like ws with keys 'w_so', 'w_toll',
+    'gap', 'cost_est', 'toll_est', 'cost', 'toll_collected', 'time', 'pareto'
+    tolls: dictionary {k: toll} for the points k on the Pareto front
+    """
+    Aeq, beq, ffdelays, coefs = data
+    K = len(ws)
+    results, tolls, times = [None]*K, [None]*K, [None]*K
+    def finish(k, result, t):
+        tolls[k], results[k], times[k] = result[0], result[1], t
+        logging.info('Weights {}: {:.2f}s, {}/{} points'.format(ws[k], t, K-results.count(None), K))
+    if processes > 1:
+        with invopt.XSolverPool(Aeq, ffdelays, processes) as pool:
+            running = [pool.submit(toll_task, (k, beq, coefs, w_so, w_toll, max_iter))
+                       for k, (w_so, w_toll) in enumerate(ws)]
+            for r in running: finish(*r.get())
+    else:
+        for k, (w_so, w_toll) in enumerate(ws):
+            start = time.time()
+            finish(k, toll_point(data, w_so, w_toll, max_iter), time.time() - start)
+    columns = dict(zip(['gap', 'cost_est', 'toll_est', 'cost', 'toll_collected'], np.array(results).T))
+    columns['w_so'], columns['w_toll'] = np.array(ws, dtype=float).T
+    columns['time'] = np.array(times)
+    columns['pareto'] = pareto(columns['cost'], columns['toll_collected'])
+    tolls = {k: tolls[k] for k in np.flatnonzero(columns['pareto'])}
+    if path is not None:
+        keys = sorted(tolls.keys())
+        np.savez(path, tolls=np.array([np.array(tolls[k]).ravel() for k in keys]), **columns)
+    return columns, tolls
+
+
+def best_point(columns):
+    """Index of the point of minimum cost on the Pareto front of toll_grid"""
+    costs = np.where(columns['pareto'], columns['cost'], np.inf)
+    return int(np.argmin(costs))
+
+
+def main_solver(graph, theta, ws=[1e-6], max_iter=5, processes=1, path=None):
     """Main solver for the toll pricing model
     
     Parameters
@@ -103,21 +225,16 @@ def main_solver(graph, theta, ws=[1e-6], max_iter=5):
     theta: coefficients of polynomial link delays
     ws: list of weights on the toll pricing (suppose w_toll=w_so)
     max_iter: maximum number of iterations
+    processes: number of processes solving the weights in parallel, see toll_grid
+    path: if given, file of the results of toll_grid
     """
     ffdelays, slopes = graph.get_ffdelays(), graph.get_slopes()
     Aeq, beq = ue.constraints(graph)
     coefs = invopt.compute_coefs(ffdelays, slopes, theta)
     data = (Aeq, beq, ffdelays, coefs)
-    k, min_cost, toll_collected = len(ws), np.inf, 0.0
-    for i in range(k):
-        t = solver(data, ws[i], ws[i], max_iter)
-        cost, x = compute_cost((Aeq, beq, ffdelays, coefs, 'Polynomial'), t)
-        if cost < min_cost:
-            toll = t
-            min_cost = cost
-            toll_collected = (toll.T*x)[0]
-            weight = ws[i]
-    return toll, min_cost, toll_collected, weight
+    columns, tolls = toll_grid(data, [(w, w) for w in ws], max_iter, processes, path)
+    k = best_point(columns)
+    return tolls[k], columns['cost'][k], columns['toll_collected'][k], ws[k]
 
 
 def compute_gap(l, y, ks, toll, beq, scale):
@@ -132,19 +249,12 @@ def compute_gap(l, y, ks, toll, beq, scale):
     toll: vector of tolls
     scale: scaling factor for the gap function
     """
-    n, d = ks.size
-    print toll.size
-    print l.size
-    print beq.size
-    print y.size
-    gap = toll.T*l - beq.T*y
-    for i in range(n):
-        tmp = matrix(np.power(l[i],range(1,d+1)))
-        gap += ks[i,:] * tmp
-    return scale*gap[0]
-
-
-def multi_objective_solver(graph, theta, ws_so, ws_toll, max_iter=5):
+    model = DelayModel(ks[:,0], 'Polynomial', ks[:,1:])
+    gap = (toll.T*l - beq.T*y)[0] + np.dot(model.delays(l), np.array(l).ravel())
+    return scale*gap
+
+
+def multi_objective_solver(graph, theta, ws_so, ws_toll, max_iter=5, processes=1, path=None):
     """Multi-objective solver for the toll pricing model
     
     Parameters
@@ -154,6 +264,13 @@ def multi_objective_solver(graph, theta, ws_so, ws_toll, max_iter=5):
     ws_so: list of weights for so objective
     ws_toll: list of weights for toll objective
     max_iter: maximum number of iterations
+    processes: number of processes solving the grid in parallel, see toll_grid
+    path: if given, file of the results of toll_grid
+    
+    Return value
+    ------------
+    r_gap, toll_est, loss_est, toll_res, loss_res: matrices of size (len(ws_so), len(ws_toll))
+    toll: toll of minimum cost on the Pareto front of the grid
     """
     ffdelays, slopes = graph.get_ffdelays(), graph.get_slopes()
     Aeq, beq = ue.constraints(graph)
@@ -161,24 +278,13 @@ def multi_objective_solver(graph, theta, ws_so, ws_toll, max_iter=5):
     ue_cost = compute_cost((Aeq, beq, ffdelays, coefs, 'Polynomial'))[0]
     so_cost = compute_cost((Aeq, beq, ffdelays, coefs, 'Polynomial'), 0.0, True)[0]
     data = (Aeq, beq, ffdelays, coefs)
-    r_gap = matrix(0.0, (len(ws_so), len(ws_toll)))
-    loss_est = matrix(0.0, (len(ws_so), len(ws_toll)))
-    toll_est = matrix(0.0, (len(ws_so), len(ws_toll)))
-    loss_res = matrix(0.0, (len(ws_so), len(ws_toll)))
-    toll_res = matrix(0.0, (len(ws_so), len(ws_toll)))
-    
-    for i,w_so in enumerate(ws_so):
-        for j,w_toll in enumerate(ws_toll):
-            t,y,l = solver(data, w_so, w_toll, max_iter, True)
-            r_gap[i,j] = compute_gap(l, y, matrix([[ffdelays], [coefs]]), t, beq, 1/ue_cost)
-            toll_est[i,j] = (t.T*l)[0]
-            delays = compute_delays(l, ffdelays, coefs, 'Polynomial')
-            cost = (delays.T*l)[0]
-            loss_est[i,j] = (cost-so_cost)/(ue_cost-so_cost)
-            cost, x = compute_cost((Aeq, beq, ffdelays, coefs, 'Polynomial'), t)
-            toll_res[i,j] = (t.T*x)[0]
-            loss_res[i,j] = (cost-so_cost)/(ue_cost-so_cost)
-    return r_gap, toll_est, loss_est, toll_res, loss_res, t
+    ws = [(w_so, w_toll) for w_so in ws_so for w_toll in ws_toll]
+    columns, tolls = toll_grid(data, ws, max_iter, processes, path)
+    def grid(values): return matrix(values, (len(ws_toll), len(ws_so))).T
+    r_gap = grid(columns['gap']/ue_cost)
+    toll_est, loss_est = grid(columns['toll_est']), grid((columns['cost_est']-so_cost)/(ue_cost-so_cost))
+    toll_res, loss_res = grid(columns['toll_collected']), grid((columns['cost']-so_cost)/(ue_cost-so_cost))
+    return r_gap, toll_est, loss_est, toll_res, loss_res, tolls[best_point(columns)]
 
 
 if __name__ == '__main__':
@@ -9,8 +9,9 @@ import inverse_opt as invopt
 import ue_solver as ue
 import toll_pricing as tp
 from generate_graph import los_angeles
-from cvxopt import matrix
-from inverse_opt_test import experiment
+from cvxopt import matrix, solvers
+from inverse_opt_test import experiment, count_iterations
+import time
 import matplotlib.pyplot as plt
 
 
@@ -71,6 +72,55 @@ def two_step_test(ind_obs, delaytype):
     print 'UE total travel time:', ue_costs, ue_costs2
 
 
+def test_warm_start(theta, w=1e-6, max_iter=5):
+    """Benchmark the warm starts of x_solver in tp.solver on los_angeles"""
+    graph = los_angeles(theta, 'Polynomial')[3]
+    ffdelays, slopes = graph.get_ffdelays(), graph.get_slopes()
+    Aeq, beq = ue.constraints(graph)
+    data = (Aeq, beq, ffdelays, invopt.compute_coefs(ffdelays, slopes, theta))
+    counter, restore = count_iterations()
+    try:
+        for warm in [False, True]:
+            counter[0], start = 0, time.clock()
+            toll = tp.solver(data, w, w, max_iter, warm=warm)
+            print 'warm={}: {} iterations, {:.2f}s'.format(warm, counter[0], time.clock() - start)
+    finally: restore()
+
+
+def test_ty_solver(theta, w=1e-6):
+    """Benchmark tp.ty_solver with the block kktsolver of tp.ty_constraints
+    against the dense LP on los_angeles"""
+    graph = los_angeles(theta, 'Polynomial')[3]
+    ffdelays, slopes = graph.get_ffdelays(), graph.get_slopes()
+    Aeq, beq = ue.constraints(graph, True)
+    coefs = invopt.compute_coefs(ffdelays, slopes, theta)
+    data = (Aeq, beq, ffdelays, coefs)
+    l = ue.solver(graph)
+    start = time.clock()
+    x1 = tp.ty_solver(data, l, w, True)
+    t1 = time.clock() - start
+    G, kktsolver = tp.ty_constraints(Aeq, len(l))
+    c = matrix([(1.0+w)*l, -beq])
+    h = matrix([tp.compute_delays(l, ffdelays, coefs)]*(Aeq.size[1]/len(l)) + [matrix(0.0, (len(l),1))])
+    start = time.clock()
+    x2 = solvers.lp(c, matrix(G), h)['x']
+    t2 = time.clock() - start
+    print 'sparse {:.2f}s, dense {:.2f}s, objectives {:.6f} {:.6f}'.format(t1, t2, (c.T*x1)[0], (c.T*x2)[0])
+
+
+def test_toll_grid(theta, processes=4, ws=[1e-4, 1e-2, 1e0, 1e2]):
+    """Benchmark tp.multi_objective_solver on los_angeles with the grid of weights
+    solved in sequence or in parallel by tp.toll_grid"""
+    graph = los_angeles(theta, 'Polynomial')[3]
+    times, results = [], []
+    for p in [1, processes]:
+        start = time.time()
+        results.append(tp.multi_objective_solver(graph, theta, ws, ws, processes=p))
+        times.append(time.time() - start)
+    diff = max([max(abs(u-v)) for u,v in zip(results[0][:5], results[1][:5])])
+    print 'sequential {:.2f}s, {} processes {:.2f}s, max diff {:.1e}'.format(times[0], processes, times[1], diff)
+
+
 def plot_results(delaytype):
     """Plot results from two_step_test()
     """
@@ -206,6 +256,9 @@ def main():
     test_toll_pricing(theta, True)
     #two_step_test(ind_obs[3], 'Polynomial')
     #plot_results('Hyperbolic')
+    #test_warm_start(theta)
+    #test_ty_solver(theta)
+    #test_toll_grid(theta)
     
     
 
@@ -5,9 +5,10 @@ Created on Apr 20, 2014
 '''
 
 import numpy as np
-from cvxopt import matrix, spmatrix, solvers, spdiag, mul, div, sparse
-import rank_nullspace as rn
-from util import find_basis
+from cvxopt import matrix, spmatrix, solvers, spdiag, mul, div, sparse, umfpack
+import scipy.sparse as sps
+from collections import OrderedDict
+from scipy.sparse.csgraph import connected_components
 from kktsolver import get_kktsolver
 import logging
 if logging.getLogger().getEffectiveLevel() >= logging.DEBUG:
@@ -17,6 +18,35 @@ else:
 
 
 
+class ConstraintCache:
+    """Cache of the constraint matrices of the ue program keyed on the topology of the graph
+    
+    Graphs with the same nodes and links (e.g. los_angeles for several demand levels)
+    share the node-link incidence matrix C, the indices of its independent rows
+    and the block-diagonal Aeq, only beq depends on the demands
+    At most size topologies are kept, the least recently used one is evicted first
+    """
+    def __init__(self, size=8):
+        self.size, self.entries = size, OrderedDict()
+        
+    def get(self, arrays, rm_redundant):
+        """Return the entry {'C': C, 'ind': ind, 'Aeq': {p: Aeq}} of the topology of arrays"""
+        key = (arrays.numnodes, arrays.startnodes.tostring(), arrays.endnodes.tostring(), rm_redundant)
+        if key in self.entries: entry = self.entries.pop(key)
+        else:
+            C, ind = incidence(arrays, rm_redundant)
+            entry = {'C': C, 'ind': ind, 'Aeq': {}}
+        self.entries[key] = entry
+        if len(self.entries) > self.size: self.entries.popitem(last=False)
+        return entry
+        
+    def clear(self):
+        self.entries = OrderedDict()
+
+
+cache = ConstraintCache()
+
+
 def constraints(graph, rm_redundant = False):
     """Construct constraints for the UE link flow
     
@@ -28,14 +58,23 @@ def constraints(graph, rm_redundant = False):
     Return value
     ------------
     Aeq, beq: equality constraints Aeq*x = beq
+    Aeq is cached (see ConstraintCache) and shared by all the graphs with the same topology,
+    it must not be modified in place, copy it first (e.g. Aeq = +Aeq)
     """
-    C, ind = nodelink_incidence(graph, rm_redundant)
-    ds = [get_demands(graph, ind, id) for id,node in graph.nodes.items() if len(node.endODs) > 0]
-    p = len(ds)
-    m,n = C.size
-    Aeq, beq = spmatrix([], [], [], (p*m,p*n)), matrix(ds)
-    for k in range(p): Aeq[k*m:(k+1)*m, k*n:(k+1)*n] = C
-    return Aeq, beq
+    arrays = graph.get_arrays()
+    entry = cache.get(arrays, rm_redundant)
+    beq = demands(arrays, entry['ind'])
+    p = len(beq) / len(entry['ind'])
+    if p not in entry['Aeq']: entry['Aeq'][p] = block_diagonal(entry['C'], p)
+    return entry['Aeq'][p], beq
+
+
+def block_diagonal(C, p):
+    """Return the sparse block-diagonal matrix with p copies of C on the diagonal"""
+    m, n = C.size
+    I, J, V = np.array(C.I).ravel(), np.array(C.J).ravel(), np.array(C.V).ravel()
+    k = np.repeat(np.arange(p), len(V))
+    return spmatrix(np.tile(V, p), np.tile(I, p) + k*m, np.tile(J, p) + k*n, (p*m,p*n))
 
 
 def nodelink_incidence(graph, rm_redundant = False):
@@ -52,22 +91,53 @@ def nodelink_incidence(graph, rm_redundant = False):
     C: matrix of incidence node-link
     ind: indices of a basis formed by the rows of C
     """
-    m, n = graph.numnodes, graph.numlinks
-    entries, I, J = [], [], []
-    for id1,node in graph.nodes.items():
-        for id2,link in node.inlinks.items(): entries.append(1.0); I.append(id1-1); J.append(graph.indlinks[id2])
-        for id2,link in node.outlinks.items(): entries.append(-1.0); I.append(id1-1); J.append(graph.indlinks[id2])
+    entry = cache.get(graph.get_arrays(), rm_redundant)
+    return entry['C'], entry['ind']
+
+
+def incidence(arrays, rm_redundant = False):
+    """Build the node-link incidence matrix from graph.get_arrays()
+    
+    The rows of the nodes of a weakly connected component sum to zero, and
+    removing one of them leaves independent rows, so the rank of C is the number
+    of nodes minus the number of components and the last node of each component
+    is removed when rm_redundant is True
+    """
+    m, n = arrays.numnodes, arrays.numlinks
+    entries = np.concatenate([np.ones(n), -np.ones(n)])
+    I, J = np.concatenate([arrays.endnodes, arrays.startnodes]), np.tile(np.arange(n), 2)
     C = spmatrix(entries, I, J, (m,n))
     if rm_redundant:
-        M = matrix(C)
-        r = rn.rank(M)
-        if r < m:
-            print 'Remove {} redundant constraint(s)'.format(m-r)
-            ind = find_basis(M.trans())
-            return C[ind,:], ind
+        adj = sps.coo_matrix((np.ones(n), (arrays.startnodes, arrays.endnodes)), shape=(m,m))
+        k, labels = connected_components(adj, directed=True, connection='weak')
+        last = np.zeros(k, dtype=int)
+        np.maximum.at(last, labels, np.arange(m))
+        print 'Remove {} redundant constraint(s)'.format(k)
+        ind = np.setdiff1d(np.arange(m), last).tolist()
+        return C[ind,:], ind
     return C, range(m)
 
 
+def demands(arrays, ind):
+    """Get the demands of all the destinations in the order of np.unique(arrays.destinations)
+    with d[node] = sum of the demands to node at the destination and -demand at the origins
+    
+    Parameters
+    ----------
+    arrays: GraphArrays object from graph.get_arrays()
+    ind: indices of a basis formed by the rows of C
+    
+    Return value
+    ------------
+    beq: column matrix stacking d[ind] for each destination
+    """
+    dests, k = np.unique(arrays.destinations, return_inverse=True)
+    d = np.zeros((len(dests), arrays.numnodes))
+    np.add.at(d, (k, arrays.destinations), arrays.demands)
+    np.add.at(d, (k, arrays.origins), -arrays.demands)
+    return matrix(d[:,ind].ravel())
+
+
 def get_demands(graph, ind, node_id):
     """
     get demands for all OD pairs sharing the same destination
@@ -85,6 +155,48 @@ def get_demands(graph, ind, node_id):
     return d[ind]
 
 
+def horner(ks, l):
+    """Evaluate f_i(u) = sum_{k=1}^degree ks[i,k-1] u^k and its first two derivatives
+    at u = l[i] for all links at once using Horner's scheme
+    
+    Parameters
+    ----------
+    ks: numpy array of size (n,degree)
+    l: numpy array of size n
+    
+    Return value
+    ------------
+    f, df, d2f: numpy arrays of size n
+    """
+    n, d = ks.shape
+    f, df, d2f = np.zeros(n), np.zeros(n), np.zeros(n)
+    for k in range(d, -1, -1):
+        d2f = d2f*l + df
+        df = df*l + f
+        f = f*l
+        if k > 0: f += ks[:,k-1]
+    return f, df, 2.0*d2f
+
+
+def aggregate(x, p, n):
+    """Return l = sum_w x_w as a numpy array of size n"""
+    return np.asarray(x).reshape((p,n)).sum(axis=0)
+
+
+def repeat_gradient(df, p):
+    """Return the (1,p*n) gradient [df, ..., df] for the p blocks of x"""
+    return matrix(np.tile(df, p)).T
+
+
+def repeat_hessian(h, p):
+    """Return the (p*n,p*n) sparse hessian with diag(h) in each of the p*p blocks"""
+    n = len(h)
+    blocks = np.arange(p)*n
+    I = (np.repeat(blocks, p)[:,None] + np.arange(n)).ravel()
+    J = (np.tile(blocks, p)[:,None] + np.arange(n)).ravel()
+    return spmatrix(np.tile(h, p*p), I, J, (p*n,p*n))
+
+
 def objective_poly(x, z, ks, p, w_obs=0.0, obs=None, l_obs=None, w_gap=1.0):
     """Objective function of UE program with polynomial delay functions
     f(x) = sum_i f_i(l_i) (+ 0.5*w_obs*||l[obs]-l_obs||^2)
@@ -94,36 +206,54 @@ def objective_poly(x, z, ks, p, w_obs=0.0, obs=None, l_obs=None, w_gap=1.0):
     Parameters
     ----------
     x,z: variables for the F(x,z) function for cvxopt.solvers.cp
-    ks: matrix of size (n,degree) 
+    ks: matrix or numpy array of size (n,degree)
     p: number of w's
     w_obs: weight on the observation residual
     obs: indices of the observed links
     l_obs: observations
     """
-    n, d = ks.size
+    ks = np.asarray(ks, dtype=float)
+    n = ks.shape[0]
     if x is None: return 0, matrix(1.0/p, (p*n,1))
-    l = matrix(0.0, (n,1))
-    for k in range(p): l += x[k*n:(k+1)*n]
-    f, Df, H = 0.0, matrix(0.0, (1,n)), matrix(0.0, (n,1))
-    for i in range(n):
-        tmp = matrix(np.power(l[i],range(d+1)))
-        f += ks[i,:] * tmp[1:]
-        Df[i] = ks[i,:] * mul(tmp[:-1], matrix(range(1,d+1)))
-        H[i] = ks[i,1:] * mul(tmp[:-2], matrix(range(2,d+1)), matrix(range(1,d)))
+    l = aggregate(x, p, n)
+    f, Df, H = horner(ks, l)
+    f = f.sum()
     if w_gap != 1.0: f, Df, H = w_gap*f, w_gap*Df, w_gap*H
-    
+
     if w_obs > 0.0:
-        num_obs, e = len(obs), l[obs]-l_obs
-        f += 0.5*w_obs*e.T*e
-        Df += w_obs*spmatrix(e, [0]*num_obs, obs, (1,n))
-        H += spmatrix([w_obs]*num_obs, obs, [0]*num_obs, (n,1))
-    
-    Df = matrix([[Df]]*p)
+        e = l[obs] - np.asarray(l_obs).ravel()
+        f += 0.5*w_obs*np.dot(e, e)
+        Df[obs] += w_obs*e
+        H[obs] += w_obs
+
+    f, Df = matrix(f, (1,1)), repeat_gradient(Df, p)
     if z is None: return f, Df
-    return f, Df, matrix([[spdiag(z[0] * H)]*p]*p)
+    return f, Df, repeat_hessian(z[0]*H, p)
 
 
-def objective_hyper(x, z, ks, p):
+class LinkFlowCache:
+    """Cache of the aggregated link flow l = sum_w x_w and of the reciprocals 1/(ks[:,2]-l)
+    at the last point x where the hyperbolic objective was evaluated
+    
+    cvxopt.solvers.cp and the kktsolver call F(x) and F(x,z) at the same point,
+    a single cache shared by these calls avoids re-aggregating x
+    """
+    def __init__(self):
+        self.x = None
+        self.l = None
+        self.r = None
+        
+    def update(self, x, ks, p):
+        """Return l, 1/(ks[:,2]-l) at x, recomputed only if x changed"""
+        x = np.asarray(x).ravel()
+        if self.x is None or not np.array_equal(x, self.x):
+            self.x = x.copy()
+            self.l = x.reshape((p,-1)).sum(axis=0)
+            self.r = 1.0/(ks[:,2]-self.l)
+        return self.l, self.r
+
+
+def objective_hyper(x, z, ks, p, cache=None):
     """Objective function of UE program with hyperbolic delay functions
     f(x) = sum_i f_i(v_i) with v = sum_w x_w
     f_i(u) = ks[i,0]*u - ks[i,1]*log(ks[i,2]-u)
@@ -131,26 +261,23 @@ def objective_hyper(x, z, ks, p):
     Parameters
     ----------
     x,z: variables for the F(x,z) function for cvxopt.solvers.cp
-    ks: matrix of size (n,3) 
+    ks: matrix or numpy array of size (n,3) 
     p: number of destinations
     (we use multiple-sources single-sink node-arc formulation)
+    cache: LinkFlowCache shared by the calls to F
     """
-    n = ks.size[0]
+    ks = np.asarray(ks, dtype=float)
+    n = ks.shape[0]
     if x is None: return 0, matrix(1.0/p, (p*n,1))
-    l = matrix(0.0, (n,1))
-    for k in range(p): l += x[k*n:(k+1)*n]
-    f, Df, H = 0.0, matrix(0.0, (1,n)), matrix(0.0, (n,1))
-    for i in range(n):
-        tmp = 1.0/(ks[i,2]-l[i])
-        f += ks[i,0]*l[i] - ks[i,1]*np.log(max(ks[i,2]-l[i], 1e-13))
-        Df[i] = ks[i,0] + ks[i,1]*tmp
-        H[i] = ks[i,1]*tmp**2
-    Df = matrix([[Df]]*p)
+    if cache is None: cache = LinkFlowCache()
+    l, r = cache.update(x, ks, p)
+    f = np.sum(ks[:,0]*l - ks[:,1]*np.log(np.maximum(ks[:,2]-l, 1e-13)))
+    f, Df = matrix(f, (1,1)), repeat_gradient(ks[:,0] + ks[:,1]*r, p)
     if z is None: return f, Df
-    return f, Df, sparse([[spdiag(z[0] * H)]*p]*p)
+    return f, Df, repeat_hessian(z[0]*ks[:,1]*r**2, p)
 
 
-def objective_hyper_SO(x, z, ks, p):
+def objective_hyper_SO(x, z, ks, p, cache=None):
     """Objective function of SO program with hyperbolic delay functions
     f(x) = \sum_i f_i(v_i) with v = sum_w x_w
     f_i(u) = ks[i,0]*u + ks[i,1]*u/(ks[i,2]-u)
@@ -158,23 +285,45 @@ def objective_hyper_SO(x, z, ks, p):
     Parameters
     ----------
     x,z: variables for the F(x,z) function for cvxopt.solvers.cp
-    ks: matrix of size (n,3) where ks[i,j] is the j-th parameter of the delay on link i
+    ks: matrix or numpy array of size (n,3) where ks[i,j] is the j-th parameter of the delay on link i
     p: number of destinations
     (we use multiple-sources single-sink node-arc formulation)
+    cache: LinkFlowCache shared by the calls to F
     """
-    n = ks.size[0]
+    ks = np.asarray(ks, dtype=float)
+    n = ks.shape[0]
     if x is None: return 0, matrix(1.0/p, (p*n,1))
-    l = matrix(0.0, (n,1))
-    for k in range(p): l += x[k*n:(k+1)*n]
-    f, Df, H = 0.0, matrix(0.0, (1,n)), matrix(0.0, (n,1))
-    for i in range(n):
-        tmp = 1.0/(ks[i,2]-l[i])
-        f += ks[i,0]*l[i] + ks[i,1]*l[i]*tmp
-        Df[i] = ks[i,0] + ks[i,1]*tmp + ks[i,1]*l[i]*tmp**2
-        H[i] = 2.0*ks[i,1]*tmp**2 + 2.0*ks[i,1]*l[i]*tmp**3
-    Df = matrix([[Df]]*p)
+    if cache is None: cache = LinkFlowCache()
+    l, r = cache.update(x, ks, p)
+    f = np.sum(ks[:,0]*l + ks[:,1]*l*r)
+    f, Df = matrix(f, (1,1)), repeat_gradient(ks[:,0] + ks[:,1]*r + ks[:,1]*l*r**2, p)
     if z is None: return f, Df
-    return f, Df, matrix([[spdiag(z[0] * H)]*p]*p)
+    return f, Df, repeat_hessian(z[0]*(2.0*ks[:,1]*r**2 + 2.0*ks[:,1]*l*r**3), p)
+
+
+def warm_start(x0, Aeq, beq, floor=1e-3):
+    """Repair a previous solution into a starting point for the ue program
+    x0 is projected on Aeq*x = beq and kept at floor*max|beq| from the boundary x >= 0
+    
+    Parameters
+    ----------
+    x0: previous solution (link flows per destination, from solver(full=True))
+    Aeq, beq: equality constraints of the ue program
+    floor: relative distance to the boundary
+    
+    Return value
+    ------------
+    x0: starting point
+    G: -diag(1/x0), scaling of x >= 0 such that the slacks initialized to 1
+    by cvxopt.solvers.cp correspond to x0
+    """
+    r = beq - Aeq*x0
+    if max(abs(r)) > 0.0:
+        M = Aeq*Aeq.T + spmatrix(1e-10, range(Aeq.size[0]), range(Aeq.size[0]))
+        umfpack.linsolve(M, r)
+        x0 = x0 + Aeq.T*r
+    x0 = matrix(np.maximum(np.array(x0), floor*max(abs(beq))))
+    return x0, spdiag(-div(1.0, x0))
 
 
 def get_data(graph):
@@ -186,7 +335,7 @@ def get_data(graph):
     return Aeq, beq, ffdelays, parameters, type
 
 
-def solver(graph=None, update=False, full=False, data=None, SO=False):
+def solver(graph=None, update=False, full=False, data=None, SO=False, x0=None):
     """Find the UE link flow
     
     Parameters
@@ -195,22 +344,27 @@ def solver(graph=None, update=False, full=False, data=None, SO=False):
     update: if update==True: update link flows and link,path delays in graph
     full: if full=True, also return x (link flows per OD pair)
     data: (Aeq, beq, ffdelays, parameters, type) from get_data(graph)
+    x0: if given, previous x from solver(full=True) used as warm start (see warm_start)
     """
     if data is None: data = get_data(graph)
     Aeq, beq, ffdelays, pm, type = data
     n = len(ffdelays)
     p = Aeq.size[1]/n
     A, b = spmatrix(-1.0, range(p*n), range(p*n)), matrix(0.0, (p*n,1))
+    if x0 is not None: x0, A = warm_start(x0, Aeq, beq)
     if type == 'Polynomial':
         if not SO: pm = pm * spdiag([1.0/(j+2) for j in range(pm.size[1])])
-        def F(x=None, z=None): return objective_poly(x, z, matrix([[ffdelays], [pm]]), p)
+        ks = np.array(matrix([[ffdelays], [pm]]))
+        objective = objective_poly
     if type == 'Hyperbolic':
-        if SO:
-            def F(x=None, z=None): return objective_hyper_SO(x, z, matrix([[ffdelays-div(pm[:,0],pm[:,1])], [pm]]), p)
-        else:
-            def F(x=None, z=None): return objective_hyper(x, z, matrix([[ffdelays-div(pm[:,0],pm[:,1])], [pm]]), p)
+        ks, cache = np.array(matrix([[ffdelays-div(pm[:,0],pm[:,1])], [pm]])), LinkFlowCache()
+        hyper = objective_hyper_SO if SO else objective_hyper
+        def objective(x, z, ks, p): return hyper(x, z, ks, p, cache)
+    def F(x=None, z=None):
+        if x is None and x0 is not None: return 0, x0
+        return objective(x, z, ks, p)
     dims = {'l': p*n, 'q': [], 's': []}
-    x = solvers.cp(F, G=A, h=b, A=Aeq, b=beq, kktsolver=get_kktsolver(A, dims, Aeq, F))['x']
+    x = solvers.cp(F, G=A, h=b, A=Aeq, b=beq, kktsolver=get_kktsolver(A, dims, Aeq, F, p))['x']
     linkflows = matrix(0.0, (n,1))
     for k in range(p): linkflows += x[k*n:(k+1)*n]
     
@@ -6,9 +6,12 @@ Created on Apr 21, 2014
 
 import numpy as np
 import ue_solver as ue
+import kktsolver
+import rank_nullspace as rn
 import draw_graph as d
 from generate_graph import small_example, los_angeles, los_angeles_2
-from cvxopt import matrix, mul
+from cvxopt import matrix, spmatrix, spdiag, mul
+import time
 
 
 def test1():
@@ -40,9 +43,118 @@ def test2(delaytype):
     print 'cost SO:', sum([link.delay*link.flow for link in g.links.values()])
 
 
+def objective_poly_loop(x, z, ks, p):
+    """Reference link-by-link implementation of ue.objective_poly used for test3"""
+    n, d = ks.size
+    l = matrix(0.0, (n,1))
+    for k in range(p): l += x[k*n:(k+1)*n]
+    f, Df, H = 0.0, matrix(0.0, (1,n)), matrix(0.0, (n,1))
+    for i in range(n):
+        tmp = matrix(np.power(l[i],range(d+1)))
+        f += ks[i,:] * tmp[1:]
+        Df[i] = ks[i,:] * mul(tmp[:-1], matrix(range(1,d+1)))
+        H[i] = ks[i,1:] * mul(tmp[:-2], matrix(range(2,d+1)), matrix(range(1,d)))
+    return f, matrix([[Df]]*p), matrix([[spdiag(z[0] * H)]*p]*p)
+
+
+def test3(ps=[1,4,16], iters=20):
+    """Benchmark one interior-point iteration, F(x) and F(x,z),
+    of the polynomial objective on los_angeles_2 for 1, 4 and 16 destinations"""
+    theta = matrix([0.0, 0.0, 0.0, 0.15])
+    g = los_angeles_2(theta, 'Polynomial')
+    n = g.numlinks
+    ks = matrix([[g.get_ffdelays()], [g.get_coefs()*spdiag([1.0/(j+2) for j in range(len(theta))])]])
+    z = matrix(1.0)
+    for p in ps:
+        x = matrix(np.random.rand(p*n)/p)
+        start = time.clock()
+        for k in range(iters): ue.objective_poly(x, None, ks, p); f, Df, H = ue.objective_poly(x, z, ks, p)
+        t1 = (time.clock() - start) / iters
+        start = time.clock()
+        for k in range(iters): f0, Df0, H0 = objective_poly_loop(x, z, ks, p)
+        t2 = (time.clock() - start) / iters
+        error = max(abs(f[0]-f0[0]), max(abs(Df-Df0)), max(abs(matrix(H)-H0)))
+        print 'p={}: vectorized {:.2e}s, loop {:.2e}s per iteration, max error {:.1e}'.format(p, t1, t2, error)
+
+
+def test4(ps=[1,2,4,8]):
+    """Benchmark ue.solver with the sparse and the dense kktsolver on los_angeles_2
+    sweeping the number of destinations, each node k < p sending 0.1 to the others"""
+    theta = matrix([0.0, 0.0, 0.0, 0.15])
+    g = los_angeles_2(theta, 'Polynomial')
+    C = ue.nodelink_incidence(g)[0]
+    m, n = C.size
+    ffdelays, coefs = g.get_ffdelays(), g.get_coefs()
+    for p in ps:
+        ds = []
+        for k in range(p):
+            d = matrix(-0.1, (m,1))
+            d[k] = 0.1*(m-1)
+            ds.append(d)
+        data = (ue.block_diagonal(C, p), matrix(ds), ffdelays, coefs, 'Polynomial')
+        times, flows = [], []
+        for sparse in [True, False]:
+            kktsolver.options['sparse'] = sparse
+            start = time.clock()
+            flows.append(ue.solver(data=data))
+            times.append(time.clock() - start)
+        kktsolver.options['sparse'] = True
+        print 'p={}: sparse {:.2f}s, dense {:.2f}s, max diff {:.1e}'.format(p, times[0], times[1], max(abs(flows[0]-flows[1])))
+
+
+def test5():
+    """Solve los_angeles for the four demand levels, cold or warm started
+    from the solution for the previous demand level"""
+    theta = matrix([0.0, 0.0, 0.0, 0.15])
+    graphs = los_angeles(theta, 'Polynomial')
+    for warm in [False, True]:
+        x, start = None, time.clock()
+        for g in graphs:
+            l, x = ue.solver(g, full=True, x0=x if warm else None)
+        print 'warm={}: {:.2f}s'.format(warm, time.clock() - start)
+
+
+def test6():
+    """Check the combinatorial removal of redundant constraints against the rank of C
+    and time ue.constraints for the four demand levels of los_angeles"""
+    theta = matrix([0.0, 0.0, 0.0, 0.15])
+    graphs = los_angeles(theta, 'Polynomial')
+    C, ind = ue.nodelink_incidence(graphs[0], True)
+    print 'rank of C: {}, rows kept: {}'.format(rn.rank(matrix(ue.nodelink_incidence(graphs[0])[0])), len(ind))
+    print 'rank of C[ind,:]: {}'.format(rn.rank(matrix(C)))
+    ue.cache.clear()
+    for g in graphs:
+        start = time.clock()
+        Aeq, beq = ue.constraints(g, True)
+        print 'constraints: {:.4f}s'.format(time.clock() - start)
+
+
+def test7(iters=20):
+    """Benchmark the DelayModel against the per-link delay functions
+    on los_angeles_2 with Polynomial delays and los_angeles with Hyperbolic delays
+    (los_angeles_2 only has Polynomial delays)"""
+    graphs = [('Polynomial', los_angeles_2(matrix([0.0, 0.0, 0.0, 0.15]), 'Polynomial')),
+              ('Hyperbolic', los_angeles((3.5, 3.0), 'Hyperbolic')[0])]
+    for delaytype, g in graphs:
+        l = ue.solver(g)
+        links = [g.links[id] for id in g.get_arrays().link_ids]
+        start = time.clock()
+        for k in range(iters): delays1 = g.get_delay_model().delays(l)
+        t1 = (time.clock() - start) / iters
+        start = time.clock()
+        for k in range(iters): delays2 = [link.delayfunc.compute_delay(l[i]) for i,link in enumerate(links)]
+        t2 = (time.clock() - start) / iters
+        print '{}: model {:.2e}s, loop {:.2e}s, max diff {:.1e}'.format(delaytype, t1, t2, max(abs(delays1-delays2)))
+
+
 def main():
     #test1()
     test2('Polynomial')
+    #test3()
+    #test4()
+    #test5()
+    #test6()
+    #test7()
     #test2('Hyperbolic')
 
 
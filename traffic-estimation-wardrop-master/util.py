@@ -10,6 +10,7 @@ from cvxopt import matrix
 import numpy.random as ra
 import networkx as nx
 import math
+import rank_nullspace as rn
 
 
 def place_zeros(M, tol=1e-13):
@@ -21,7 +22,9 @@ def place_zeros(M, tol=1e-13):
 
 
 def find_basis(M):
-    """Find the indices of the columns of M that form a basis or range(M)"""
+    """Find the indices of the columns of M that form a basis or range(M)
+    if M is sparse, see rank_nullspace.sparse_basis"""
+    if rn.options['sparse'] and rn.issparse(M): return rn.sparse_basis(M)
     p,l,u = sla.lu(M)
     ind = [i for i in range(u.shape[0]) if u[i,i] != 0.0]
     if u[i,i] == 0: